@@ -2,107 +2,346 @@
 # add the CQI value in the output file
 # add the user request to the output file 
 import xml.etree.ElementTree as ET
+import argparse
+import contextlib
+import cProfile
+import hashlib
+import json
+import os
+import sys
+import time
+import tracemalloc
 import numpy as np
-import matplotlib.pyplot as plt
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PolyCollection
+from matplotlib.figure import Figure
 import random
 import math
 from pyproj import Transformer
-from shapely.geometry import Point, Polygon, LineString
+import shapely
+from shapely import STRtree
 import csv
+from concurrent.futures import ProcessPoolExecutor
 
-def parse_osm_buildings(file_path):
-    """Parse OSM file to extract building information."""
-    tree = ET.parse(file_path)
-    root = tree.getroot()
+# Profiling =======================================================================
+def start_profile(track_memory=True):
+    """
+    Start a profiling report. Stages are recorded with profile_stage; with track_memory
+    tracemalloc is started so each stage also reports its peak memory.
+    """
+    owns_tracing = track_memory and not tracemalloc.is_tracing()
+    if owns_tracing:
+        tracemalloc.start()
+    return {'track_memory': track_memory, 'owns_tracing': owns_tracing, 'started': time.perf_counter(), 'stages': []}
+
+def stop_profile(profile):
+    """Stop tracemalloc if start_profile started it."""
+    if profile is not None and profile['owns_tracing'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+@contextlib.contextmanager
+def profile_stage(profile, name):
+    """
+    Record the wall time and peak traced memory of a block as one stage of profile.
+    Yields a dict for extra stage details (counts, formats, ...). Does nothing when
+    profile is None. Stages are flat: do not nest them.
+    """
+    info = {}
+    if profile is None:
+        yield info
+        return
     
-    buildings = []
-    nodes = {}
+    track_memory = profile['track_memory'] and tracemalloc.is_tracing()
+    if track_memory:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        stage = {'stage': name, 'wall_s': round(time.perf_counter() - start, 6)}
+        if track_memory:
+            # Peak allocated on top of what was live when the stage started
+            stage['peak_mem_MB'] = round((tracemalloc.get_traced_memory()[1] - baseline) / 2**20, 3)
+        stage.update(info)
+        profile['stages'].append(stage)
+
+def write_profile_report(profile, output_path, **metadata):
+    """Write the recorded stages, total wall time and any metadata (map, counts, ...) as JSON."""
+    report = {
+        'total_wall_s': round(time.perf_counter() - profile['started'], 6),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'shapely': shapely.__version__,
+        'memory_tracked': profile['track_memory'],
+        **metadata,
+        'stages': profile['stages']
+    }
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+def _iter_osm_elements(file_path, tags):
+    """Stream top-level OSM elements with the given tags, clearing each one once it has been yielded."""
+    context = ET.iterparse(file_path, events=('start', 'end'))
+    _, root = next(context)
     
-    # Extract all nodes
-    for node in root.findall('./node'):
-        node_id = node.get('id')
-        lat = float(node.get('lat'))
-        lon = float(node.get('lon'))
-        nodes[node_id] = (lat, lon)
+    for event, elem in context:
+        if event != 'end' or elem.tag not in ('node', 'way', 'relation'):
+            continue
+        if elem.tag in tags:
+            yield elem
+        # Drop the element and its already-processed siblings to keep memory flat
+        elem.clear()
+        root.clear()
+
+def parse_osm_buildings(file_path):
+    """
+    Parse OSM file to extract building information.
+    The file is streamed twice: the first pass collects building ways and the
+    node ids they reference, the second keeps only those nodes.
+    """
+    building_ways = []
+    referenced = set()
     
-    # Extract buildings
-    for way in root.findall('./way'):
+    # Pass 1: building ways
+    for way in _iter_osm_elements(file_path, ('way',)):
         is_building = False
         for tag in way.findall('./tag'):
             if tag.get('k') == 'building':
                 is_building = True
                 break
         
-        if is_building:
-            building_nodes = []
-            height = 10.0  # Default height in meters
-            
-            # Extract height if available
-            for tag in way.findall('./tag'):
-                if tag.get('k') == 'height':
-                    try:
-                        height = float(tag.get('v'))
-                    except ValueError:
-                        pass
-                elif tag.get('k') == 'building:levels':
-                    try:
-                        # Approximate height based on levels (3m per level)
-                        height = float(tag.get('v')) * 3.0
-                    except ValueError:
-                        pass
-            
-            # Get building outline
-            node_refs = []
-            for nd in way.findall('./nd'):
-                ref = nd.get('ref')
-                node_refs.append(ref)
-            
-            # Ensure the building polygon is closed
-            if node_refs and node_refs[0] != node_refs[-1]:
-                node_refs.append(node_refs[0])
-            
-            for ref in node_refs:
-                if ref in nodes:
-                    building_nodes.append(nodes[ref])
-            
-            if len(building_nodes) >= 3:  # Need at least 3 points for a valid polygon
-                buildings.append({
-                    'nodes': building_nodes,
-                    'height': height
-                })
+        if not is_building:
+            continue
+        
+        height = 10.0  # Default height in meters
+        
+        # Extract height if available
+        for tag in way.findall('./tag'):
+            if tag.get('k') == 'height':
+                try:
+                    height = float(tag.get('v'))
+                except ValueError:
+                    pass
+            elif tag.get('k') == 'building:levels':
+                try:
+                    # Approximate height based on levels (3m per level)
+                    height = float(tag.get('v')) * 3.0
+                except ValueError:
+                    pass
+        
+        # Get building outline
+        node_refs = [nd.get('ref') for nd in way.findall('./nd')]
+        
+        # Ensure the building polygon is closed
+        if node_refs and node_refs[0] != node_refs[-1]:
+            node_refs.append(node_refs[0])
+        
+        building_ways.append((way.get('id'), node_refs, height))
+        referenced.update(node_refs)
+    
+    # Pass 2: only nodes referenced by a building
+    nodes = {}
+    for node in _iter_osm_elements(file_path, ('node',)):
+        node_id = node.get('id')
+        if node_id in referenced:
+            nodes[node_id] = (float(node.get('lat')), float(node.get('lon')))
+    
+    buildings = []
+    for way_id, node_refs, height in building_ways:
+        building_nodes = [nodes[ref] for ref in node_refs if ref in nodes]
+        
+        if len(building_nodes) >= 3:  # Need at least 3 points for a valid polygon
+            buildings.append({
+                'id': way_id,
+                'nodes': building_nodes,
+                'height': height
+            })
     
     return buildings
 
-def convert_to_cartesian(buildings):
-    """Convert geographic coordinates to local Cartesian coordinates."""
+def _make_transformer(ref_lat, ref_lon):
+    """Transverse Mercator projection centred on the reference point."""
+    return Transformer.from_crs(
+        "EPSG:4326",  # WGS84
+        f"+proj=tmerc +lat_0={ref_lat} +lon_0={ref_lon} +k=1 +x_0=0 +y_0=0 +ellps=WGS84 +units=m +no_defs",
+        always_xy=True
+    )
+
+def convert_to_cartesian(buildings, ref_point=None):
+    """
+    Convert geographic coordinates to local Cartesian coordinates.
+    Pass ref_point (lat, lon) to project into an existing frame, e.g. that of an earlier map version.
+    """
     if not buildings:
         return [], None, (0, 0)
     
     # Get reference point (center of the first building)
-    ref_lat = sum(node[0] for node in buildings[0]['nodes']) / len(buildings[0]['nodes'])
-    ref_lon = sum(node[1] for node in buildings[0]['nodes']) / len(buildings[0]['nodes'])
+    if ref_point is not None:
+        ref_lat, ref_lon = ref_point
+    else:
+        ref_lat = sum(node[0] for node in buildings[0]['nodes']) / len(buildings[0]['nodes'])
+        ref_lon = sum(node[1] for node in buildings[0]['nodes']) / len(buildings[0]['nodes'])
     
     # Create transformer
-    transformer = Transformer.from_crs(
-        "EPSG:4326",  # WGS84
-        f"+proj=tmerc +lat_0={ref_lat} +lon_0={ref_lon} +k=1 +x_0=0 +y_0=0 +ellps=WGS84 +units=m +no_defs",
-        always_xy=True
+    transformer = _make_transformer(ref_lat, ref_lon)
+    
+    # Concatenate the nodes of all buildings and project them in a single call
+    counts = [len(building['nodes']) for building in buildings]
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    lat_lon = np.array([node for building in buildings for node in building['nodes']], dtype=float)
+    x, y = transformer.transform(lat_lon[:, 1], lat_lon[:, 0])
+    xy = np.column_stack([x, y])
+    
+    cartesian_buildings = _buildings_from_flat(
+        xy,
+        offsets,
+        [building['height'] for building in buildings],
+        [building.get('id') for building in buildings]
     )
     
+    return cartesian_buildings, transformer, (ref_lat, ref_lon)
+
+def _buildings_from_flat(xy, offsets, heights, ids):
+    """
+    Split a flat (M,2) coordinate array back into building dicts.
+    Building i owns rows offsets[i]:offsets[i+1]; footprints are built in one vectorized call.
+    """
+    ring_index = np.repeat(np.arange(len(heights)), np.diff(offsets))
+    polygons = shapely.polygons(shapely.linearrings(xy, indices=ring_index)) if len(heights) else []
+    
+    # Prepare footprints once so point-in-building tests reuse their edge index
+    shapely.prepare(polygons)
+    
     cartesian_buildings = []
-    for building in buildings:
-        cartesian_nodes = []
-        for lat, lon in building['nodes']:
-            x, y = transformer.transform(lon, lat)
-            cartesian_nodes.append((x, y))
-        
+    for i, polygon in enumerate(polygons):
         cartesian_buildings.append({
-            'nodes': cartesian_nodes,
-            'height': building['height'],
-            'polygon': Polygon(cartesian_nodes)
+            'id': ids[i],
+            'nodes': [tuple(node) for node in xy[offsets[i]:offsets[i + 1]].tolist()],
+            'height': float(heights[i]),
+            'polygon': polygon
         })
     
-    return cartesian_buildings, transformer, (ref_lat, ref_lon)
+    return cartesian_buildings
+
+# Bump when the layout of the geometry cache changes
+GEOMETRY_CACHE_VERSION = 1
+
+def _file_digest(file_path, chunk_size=1 << 20):
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def save_geometry_cache(cache_path, cartesian_buildings, ref_point, **arrays):
+    """Write projected building footprints (and any extra named arrays) to a compact .npz file."""
+    counts = [len(building['nodes']) for building in cartesian_buildings]
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    xy = np.array([node for building in cartesian_buildings for node in building['nodes']], dtype=float).reshape(-1, 2)
+    
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    np.savez_compressed(
+        cache_path,
+        xy=xy,
+        offsets=offsets,
+        heights=np.array([building['height'] for building in cartesian_buildings], dtype=float),
+        ids=np.array([building.get('id') or '' for building in cartesian_buildings], dtype=str),
+        ref_point=np.array(ref_point, dtype=float),
+        **arrays
+    )
+
+def load_geometry_cache(cache_path):
+    """Rebuild projected buildings from a geometry cache written by save_geometry_cache."""
+    with np.load(cache_path) as data:
+        xy = data['xy']
+        offsets = data['offsets']
+        heights = data['heights']
+        ids = data['ids']
+        ref_lat, ref_lon = data['ref_point']
+    
+    cartesian_buildings = _buildings_from_flat(xy, offsets, heights, [str(i) or None for i in ids])
+    return cartesian_buildings, _make_transformer(ref_lat, ref_lon), (float(ref_lat), float(ref_lon))
+
+def _geometry_cache_dir(file_path, cache_dir=None):
+    """Default geometry cache directory: .geometry_cache next to the OSM file."""
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(file_path)), '.geometry_cache')
+    return cache_dir
+
+def _geometry_cache_path(file_path, cache_dir, digest):
+    """Geometry cache file for one version (content hash) of an OSM file."""
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(cache_dir, f"{base_name}.v{GEOMETRY_CACHE_VERSION}.{digest[:16]}.npz")
+
+def load_buildings(file_path, cache_dir=None, ref_point=None, profile=None):
+    """
+    Load projected buildings for an OSM file, using the on-disk geometry cache when possible.
+    The cache is keyed by the file's content hash, so edited maps are re-parsed automatically.
+    With ref_point the buildings are projected around that (lat, lon), so an edited map
+    lines up with its previous version. Returns the same tuple as convert_to_cartesian.
+    Parsing, projection and cache I/O are recorded as stages of profile, if given.
+    """
+    cache_dir = _geometry_cache_dir(file_path, cache_dir)
+    cache_path = _geometry_cache_path(file_path, cache_dir, _file_digest(file_path))
+    
+    cached = None
+    if os.path.exists(cache_path):
+        try:
+            with profile_stage(profile, 'geometry_cache_load') as stage:
+                cached = load_geometry_cache(cache_path)
+                stage['buildings'] = len(cached[0])
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Ignoring unreadable geometry cache {cache_path}: {e}")
+    if cached is not None and (ref_point is None or np.allclose(cached[2], ref_point, rtol=0, atol=1e-12)):
+        return cached
+    
+    with profile_stage(profile, 'osm_parse') as stage:
+        buildings = parse_osm_buildings(file_path)
+        stage['buildings'] = len(buildings)
+    
+    # The cache always holds the file's own frame
+    if cached is None:
+        with profile_stage(profile, 'projection') as stage:
+            cached = convert_to_cartesian(buildings)
+            stage['nodes'] = sum(len(building['nodes']) for building in buildings)
+        if cached[0]:
+            try:
+                with profile_stage(profile, 'geometry_cache_write'):
+                    save_geometry_cache(cache_path, cached[0], cached[2])
+            except OSError as e:
+                print(f"Could not write geometry cache {cache_path}: {e}")
+    
+    if ref_point is None or np.allclose(cached[2], ref_point, rtol=0, atol=1e-12):
+        return cached
+    with profile_stage(profile, 'projection'):
+        return convert_to_cartesian(buildings, ref_point)
+
+def load_previous_buildings(file_path, cache_dir=None):
+    """
+    Most recent cached geometry of an earlier version of an OSM file, i.e. the newest
+    cache entry whose content hash differs from the current file.
+    Returns the same tuple as load_buildings, or None if there is no earlier version.
+    """
+    cache_dir = _geometry_cache_dir(file_path, cache_dir)
+    if not os.path.isdir(cache_dir):
+        return None
+    
+    digest = _file_digest(file_path)[:16]
+    prefix = f"{os.path.splitext(os.path.basename(file_path))[0]}.v{GEOMETRY_CACHE_VERSION}."
+    candidates = [
+        os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+        if name.startswith(prefix) and name.endswith('.npz') and name[len(prefix):-len('.npz')] != digest
+    ]
+    for cache_path in sorted(candidates, key=os.path.getmtime, reverse=True):
+        try:
+            return load_geometry_cache(cache_path)
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Ignoring unreadable geometry cache {cache_path}: {e}")
+    return None
 
 def find_tallest_building(buildings):
     """Find the tallest building in the dataset."""
@@ -111,6 +350,10 @@ def find_tallest_building(buildings):
     tallest = max(buildings, key=lambda x: x['height'])
     return tallest
 
+def find_tallest_buildings(buildings, k):
+    """Find the k tallest buildings, tallest first."""
+    return sorted(buildings, key=lambda x: x['height'], reverse=True)[:k]
+
 def place_tx(tallest_building):
     """Place transmitter at the center of the tallest building."""
     # Calculate centroid of the building
@@ -121,99 +364,424 @@ def place_tx(tallest_building):
     tx_position = (centroid.x, centroid.y, height)
     return tx_position
 
-def generate_rx_positions(bounds, num_rx, buildings, min_distance=5.0):
-    """Generate random RX positions, avoiding building interiors."""
+def build_footprint_grid(polygons, cell=None):
+    """
+    Uniform bucket grid over building bounding boxes for point-in-building tests.
+    Every cell lists the buildings whose boxes overlap it, in CSR layout
+    (owners[start[c]:start[c + 1]]). The cell size defaults to the median building extent.
+    """
+    bounds = shapely.bounds(polygons).reshape(-1, 4)
+    if cell is None:
+        extent = np.maximum(bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1])
+        cell = max(float(np.median(extent)), 1.0) if len(extent) else 1.0
+    origin = bounds[:, :2].min(axis=0) if len(bounds) else np.zeros(2)
+    
+    # Cell range covered by each bounding box
+    i0 = np.floor((bounds[:, 0] - origin[0]) / cell).astype(np.int64)
+    i1 = np.floor((bounds[:, 2] - origin[0]) / cell).astype(np.int64)
+    j0 = np.floor((bounds[:, 1] - origin[1]) / cell).astype(np.int64)
+    j1 = np.floor((bounds[:, 3] - origin[1]) / cell).astype(np.int64)
+    shape = (int(i1.max()) + 1, int(j1.max()) + 1) if len(bounds) else (1, 1)
+    
+    # Expand every box into its cells, then sort by cell
+    span_j = j1 - j0 + 1
+    counts = (i1 - i0 + 1) * span_j
+    owners = np.repeat(np.arange(len(bounds)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cells = (i0[owners] + local // span_j[owners]) * shape[1] + j0[owners] + local % span_j[owners]
+    order = np.argsort(cells, kind='stable')
+    
+    return {
+        'origin': origin,
+        'cell': cell,
+        'shape': shape,
+        'start': np.searchsorted(cells[order], np.arange(shape[0] * shape[1] + 1)),
+        'owners': owners[order]
+    }
+
+def _footprint_candidates(x, y, grid):
+    """(point, building) pairs whose grid cell the point falls into."""
+    i = np.floor((x - grid['origin'][0]) / grid['cell']).astype(np.int64)
+    j = np.floor((y - grid['origin'][1]) / grid['cell']).astype(np.int64)
+    on_grid = np.nonzero((i >= 0) & (i < grid['shape'][0]) & (j >= 0) & (j < grid['shape'][1]))[0]
+    cells = i[on_grid] * grid['shape'][1] + j[on_grid]
+    
+    counts = grid['start'][cells + 1] - grid['start'][cells]
+    point_idx = np.repeat(on_grid, counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    building_idx = grid['owners'][np.repeat(grid['start'][cells], counts) + local]
+    return point_idx, building_idx
+
+def _footprint_hits(x, y, buildings, index=None):
+    """(point, building) pairs with the point strictly inside the footprint, plus building heights."""
+    if index is not None:
+        polygons, grid, heights = index['polygons'], index['grid'], index['heights']
+    else:
+        polygons = np.array([building['polygon'] for building in buildings], dtype=object)
+        grid = build_footprint_grid(polygons)
+        heights = np.array([building['height'] for building in buildings], dtype=float)
+    
+    point_idx, building_idx = _footprint_candidates(x, y, grid)
+    hit = shapely.contains_xy(polygons[building_idx], x[point_idx], y[point_idx])
+    return point_idx[hit], building_idx[hit], heights
+
+def points_in_buildings(x, y, buildings, index=None):
+    """Return a boolean mask of the points (x, y) that fall inside any building footprint."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    inside = np.zeros(len(x), dtype=bool)
+    if len(x) == 0 or not buildings:
+        return inside
+    
+    point_idx, _, _ = _footprint_hits(x, y, buildings, index)
+    inside[point_idx] = True
+    return inside
+
+def points_in_prisms(points, buildings, index=None):
+    """
+    Return a boolean mask of the 3D points that lie inside a building prism,
+    i.e. inside its footprint and below its roof.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    inside = np.zeros(len(points), dtype=bool)
+    if len(points) == 0 or not buildings:
+        return inside
+    
+    point_idx, building_idx, heights = _footprint_hits(points[:, 0], points[:, 1], buildings, index)
+    below_roof = points[point_idx, 2] < heights[building_idx]
+    inside[point_idx[below_roof]] = True
+    return inside
+
+def _accept_min_distance(cand_x, cand_y, grid, grid_origin, cell, accepted_xy, num_accepted, min_distance):
+    """
+    Append candidates that keep min_distance to every accepted point (and to each other).
+    Uses a background grid with cell size min_distance/sqrt(2), so each cell holds at most
+    one point and conflicts can only come from the surrounding 5x5 cells. Candidates are
+    processed in 9 phases by (cell_x mod 3, cell_y mod 3); two candidates of the same phase
+    are always more than min_distance apart, so each phase is resolved fully vectorized.
+    Accepted points are written to accepted_xy (up to its capacity); returns the new count.
+    """
+    # Cell coordinates, offset by the 2-cell padding around the grid
+    ci = np.floor((cand_x - grid_origin[0]) / cell).astype(np.int64) + 2
+    cj = np.floor((cand_y - grid_origin[1]) / cell).astype(np.int64) + 2
+    
+    for phase_i in range(3):
+        for phase_j in range(3):
+            members = np.nonzero((ci % 3 == phase_i) & (cj % 3 == phase_j))[0]
+            if len(members) == 0:
+                continue
+            
+            # One candidate per cell: keep the first drawn
+            cell_id = ci[members] * grid.shape[1] + cj[members]
+            _, first = np.unique(cell_id, return_index=True)
+            members = np.sort(members[first])
+            
+            # Check the 5x5 neighbourhood against already accepted points
+            ok = grid[ci[members], cj[members]] < 0
+            for di in range(-2, 3):
+                for dj in range(-2, 3):
+                    neighbour = grid[ci[members] + di, cj[members] + dj]
+                    nearest = accepted_xy[np.maximum(neighbour, 0)]
+                    dist_sq = (cand_x[members] - nearest[:, 0]) ** 2 + (cand_y[members] - nearest[:, 1]) ** 2
+                    ok &= ~((neighbour >= 0) & (dist_sq < min_distance ** 2))
+            
+            members = members[ok][:len(accepted_xy) - num_accepted]
+            
+            # Register accepted points so later phases see them
+            slots = np.arange(num_accepted, num_accepted + len(members))
+            accepted_xy[slots, 0] = cand_x[members]
+            accepted_xy[slots, 1] = cand_y[members]
+            grid[ci[members], cj[members]] = slots
+            num_accepted += len(members)
+            
+            if num_accepted == len(accepted_xy):
+                return num_accepted
+    
+    return num_accepted
+
+def generate_rx_positions(bounds, num_rx, buildings, min_distance=5.0, index=None, seed=None,
+                          max_attempts=None, batch_size=None, stats=None):
+    """
+    Generate random RX positions, avoiding building interiors.
+    Candidates are drawn in NumPy batches; building interiors are masked with the
+    spatial index and min_distance is enforced with a grid hash (Poisson-disk style).
+    Pass seed for a reproducible layout. Returns an (N,3) array.
+    If stats is a dict, the requested, generated and attempted counts are stored in it.
+    """
     min_x, max_x, min_y, max_y = bounds
+    z = 1.5  # Assume RX is at human height (1.5m)
+    rng = np.random.default_rng(seed)
+    
+    if max_attempts is None:
+        max_attempts = max(100000, 50 * num_rx)  # Prevent infinite loops
     
-    rx_positions = []
+    accepted_xy = np.zeros((num_rx, 2), dtype=float)
+    num_accepted = 0
     attempts = 0
-    max_attempts = 100000  # Prevent infinite loops
     
-    while len(rx_positions) < num_rx and attempts < max_attempts:
-        # Generate random position within bounds
-        x = random.uniform(min_x, max_x)
-        y = random.uniform(min_y, max_y)
-        z = 1.5  # Assume RX is at human height (1.5m)
-        
-        point = Point(x, y)
-        
-        # Check if point is inside any building
-        inside_building = False
-        for building in buildings:
-            if building['polygon'].contains(point):
-                inside_building = True
-                break
+    # Background grid for the minimum-distance test, padded by 2 cells on every side
+    use_grid = min_distance > 0
+    if use_grid:
+        cell = min_distance / math.sqrt(2)
+        grid_shape = (int(math.ceil((max_x - min_x) / cell)) + 5, int(math.ceil((max_y - min_y) / cell)) + 5)
+        grid = np.full(grid_shape, -1, dtype=np.int64)
+    
+    while num_accepted < num_rx and attempts < max_attempts:
+        batch = batch_size or max(1000, 2 * (num_rx - num_accepted))
+        batch = min(batch, max_attempts - attempts)
+        attempts += batch
         
-        # Check minimum distance from existing receivers
-        too_close = False
-        for rx_pos in rx_positions:
-            dist = math.sqrt((x - rx_pos[0])**2 + (y - rx_pos[1])**2)
-            if dist < min_distance:
-                too_close = True
-                break
+        # Generate random positions within bounds
+        x = rng.uniform(min_x, max_x, batch)
+        y = rng.uniform(min_y, max_y, batch)
         
-        if not inside_building and not too_close:
-            rx_positions.append((x, y, z))
+        # Drop points inside any building
+        outside = ~points_in_buildings(x, y, buildings, index)
+        x = x[outside]
+        y = y[outside]
         
-        attempts += 1
+        # Enforce the minimum distance from existing receivers and between candidates
+        if use_grid:
+            num_accepted = _accept_min_distance(x, y, grid, (min_x, min_y), cell, accepted_xy, num_accepted, min_distance)
+        else:
+            take = min(len(x), num_rx - num_accepted)
+            accepted_xy[num_accepted:num_accepted + take, 0] = x[:take]
+            accepted_xy[num_accepted:num_accepted + take, 1] = y[:take]
+            num_accepted += take
+    
+    rx_positions = np.column_stack([accepted_xy[:num_accepted], np.full(num_accepted, z)])
     
     print(f"Generated {len(rx_positions)} RX positions after {attempts} attempts")
+    if stats is not None:
+        stats.update({'requested': num_rx, 'generated': len(rx_positions), 'attempts': attempts})
     if len(rx_positions) < num_rx:
         print(f"Warning: Only generated {len(rx_positions)} out of {num_rx} requested positions")
     
     return rx_positions
 
-def has_line_of_sight(p1, p2, buildings):
+def build_edge_table(buildings):
+    """Flatten building footprints into NumPy wall arrays for the vectorized LOS engine."""
+    starts = []
+    ends = []
+    heights = []
+    owners = []
+    offsets = [0]
+    
+    for i, building in enumerate(buildings):
+        # Exterior ring is always closed, so consecutive coordinate pairs are the walls
+        ring = np.asarray(building['polygon'].exterior.coords, dtype=float)[:, :2]
+        starts.append(ring[:-1])
+        ends.append(ring[1:])
+        heights.append(np.full(len(ring) - 1, building['height'], dtype=float))
+        owners.append(np.full(len(ring) - 1, i, dtype=np.int64))
+        offsets.append(offsets[-1] + len(ring) - 1)
+    
+    if not buildings:
+        empty = np.empty(0, dtype=float)
+        return {
+            'x1': empty, 'y1': empty, 'x2': empty, 'y2': empty,
+            'height': empty,
+            'building': np.empty(0, dtype=np.int64),
+            'offsets': np.zeros(1, dtype=np.int64)
+        }
+    
+    starts = np.concatenate(starts)
+    ends = np.concatenate(ends)
+    return {
+        'x1': starts[:, 0],
+        'y1': starts[:, 1],
+        'x2': ends[:, 0],
+        'y2': ends[:, 1],
+        'height': np.concatenate(heights),
+        'building': np.concatenate(owners),
+        'offsets': np.asarray(offsets, dtype=np.int64)
+    }
+
+def build_spatial_index(buildings):
+    """
+    Build an STRtree over building footprints for ray queries, a bucket grid over the
+    (prepared) footprints for point-in-building tests and the wall table used for LOS.
+    """
+    polygons = np.array([building['polygon'] for building in buildings], dtype=object)
+    shapely.prepare(polygons)
+    return {
+        'tree': STRtree(polygons),
+        'polygons': polygons,
+        'grid': build_footprint_grid(polygons),
+        'heights': np.array([building['height'] for building in buildings], dtype=float),
+        'edges': build_edge_table(buildings)
+    }
+
+def _ray_edge_crossings(tx_position, rx_x, rx_y, x1, y1, x2, y2):
+    """
+    Intersect TX->RX rays with building walls.
+    Inputs broadcast against each other (the TX coordinates may be per-ray arrays),
+    so the same code serves dense (N, E) and sparse per-pair evaluation. Returns a mask
+    of walls crossed by the ray and the ray parameter t (0 at the TX, 1 at the RX) of
+    every crossing.
+    """
+    # Ray direction and wall direction
+    dx = rx_x - tx_position[0]
+    dy = rx_y - tx_position[1]
+    ex = x2 - x1
+    ey = y2 - y1
+    
+    # Offset from TX to the start of each wall
+    wx = x1 - tx_position[0]
+    wy = y1 - tx_position[1]
+    
+    denom = dx * ey - dy * ex
+    parallel = denom == 0
+    denom = np.where(parallel, 1.0, denom)
+    
+    # Solve tx + t*d = edge_start + u*e for t (along the ray) and u (along the wall)
+    t = (wx * ey - wy * ex) / denom
+    u = (wx * dy - wy * dx) / denom
+    
+    # t == 0 is the TX itself and is not treated as a crossing
+    crossed = ~parallel & (t > 0) & (t <= 1) & (u >= 0) & (u <= 1)
+    return crossed, t
+
+def query_ray_candidates(tx_position, rx_positions, index):
+    """Return (ray, building) index pairs whose bounding boxes the TX->RX rays cross."""
+    coords = np.empty((len(rx_positions), 2, 2), dtype=float)
+    coords[:, 0, 0] = tx_position[0]
+    coords[:, 0, 1] = tx_position[1]
+    coords[:, 1, :] = rx_positions[:, :2]
+    rays = shapely.linestrings(coords)
+    ray_idx, building_idx = index['tree'].query(rays)
+    return ray_idx, building_idx
+
+def _expand_to_edges(ray_idx, building_idx, offsets):
+    """Expand (ray, building) candidate pairs into (ray, wall) pairs."""
+    counts = offsets[building_idx + 1] - offsets[building_idx]
+    total = counts.sum()
+    pair_ray = np.repeat(ray_idx, counts)
+    
+    # Position of each wall within its building, added to the building's first wall
+    group_start = np.repeat(np.cumsum(counts) - counts, counts)
+    pair_edge = np.repeat(offsets[building_idx], counts) + (np.arange(total) - group_start)
+    return pair_ray, pair_edge
+
+def has_line_of_sight_batch(tx_position, rx_positions, buildings, index=None, max_pairs=2_000_000):
+    """
+    Check line of sight from one TX to many receivers at once.
+    rx_positions is an (N,3) array; returns an (N,) boolean array.
+    With a spatial index only walls of buildings whose boxes the ray crosses are tested.
+    
+    Buildings are treated as 2.5D prisms. The ray height is linear in t, so its lowest
+    point over each stretch inside a footprint is at one end of that stretch: either
+    a wall crossing (exact entry/exit t) or a ray endpoint inside the footprint.
+    Checking both against the roof height gives an exact ray-prism test.
+    """
+    rx_positions = np.asarray(rx_positions, dtype=float).reshape(-1, 3)
+    los = np.ones(len(rx_positions), dtype=bool)
+    
+    edges = index['edges'] if index is not None else build_edge_table(buildings)
+    num_edges = len(edges['height'])
+    if num_edges == 0 or len(rx_positions) == 0:
+        return los
+    
+    # Ray endpoints enclosed by a prism: a TX below a roof sees nothing,
+    # a receiver below a roof is blocked by that building
+    if points_in_prisms([tx_position], buildings, index)[0]:
+        return np.zeros(len(rx_positions), dtype=bool)
+    los &= ~points_in_prisms(rx_positions, buildings, index)
+    
+    # Process receivers in chunks so the work arrays stay bounded in memory
+    chunk = max(1, max_pairs // num_edges)
+    for start in range(0, len(rx_positions), chunk):
+        rx_chunk = rx_positions[start:start + chunk]
+        dz = rx_chunk[:, 2] - tx_position[2]
+        
+        if index is None:
+            # Dense: every ray against every wall
+            crossed, t = _ray_edge_crossings(
+                tx_position, rx_chunk[:, 0][:, None], rx_chunk[:, 1][:, None],
+                edges['x1'][None, :], edges['y1'][None, :], edges['x2'][None, :], edges['y2'][None, :]
+            )
+            z_intersect = tx_position[2] + t * dz[:, None]
+            blocked = crossed & (z_intersect < edges['height'][None, :])
+            los[start:start + chunk] &= ~blocked.any(axis=1)
+        else:
+            # Sparse: only walls of candidate buildings from the STRtree
+            ray_idx, building_idx = query_ray_candidates(tx_position, rx_chunk, index)
+            pair_ray, pair_edge = _expand_to_edges(ray_idx, building_idx, edges['offsets'])
+            crossed, t = _ray_edge_crossings(
+                tx_position, rx_chunk[pair_ray, 0], rx_chunk[pair_ray, 1],
+                edges['x1'][pair_edge], edges['y1'][pair_edge], edges['x2'][pair_edge], edges['y2'][pair_edge]
+            )
+            z_intersect = tx_position[2] + t * dz[pair_ray]
+            blocked = crossed & (z_intersect < edges['height'][pair_edge])
+            blocked_count = np.bincount(pair_ray[blocked], minlength=len(rx_chunk))
+            los[start:start + chunk] &= blocked_count == 0
+    
+    return los
+
+def has_line_of_sight(p1, p2, buildings, index=None):
     """Check if there's line of sight between two points."""
-    line = LineString([(p1[0], p1[1]), (p2[0], p2[1])])
+    return bool(has_line_of_sight_batch(p1, [p2], buildings, index=index)[0])
+
+# Radio parameters shared by receiver tracing and coverage maps
+FREQUENCY_HZ = 2.4e9  # 2.4 GHz (in Hz)
+BANDWIDTH_HZ = 20e6  # 20 MHz
+NOISE_FIGURE_DB = 8  # Typical receiver noise figure
+
+def calculate_noise_floor(bandwidth, noise_figure_dB):
+    """Receiver noise floor in dBm for a given bandwidth (Hz) and noise figure; accepts arrays."""
+    thermal_noise_dBm = -174 + 10 * np.log10(bandwidth)  # -174 dBm/Hz + 10log10(bandwidth)
+    return thermal_noise_dBm + noise_figure_dB
+
+def calculate_path_loss_array(distance, frequency, has_los):
+    """
+    Array version of the propagation model behind calculate_path_loss.
+    distance (m), frequency (Hz) and has_los broadcast against each other.
+    """
+    # Avoid division by zero or very small distances
+    distance = np.maximum(np.asarray(distance, dtype=float), 1.0)
     
-    # Vector from p1 to p2
-    dx = p2[0] - p1[0]
-    dy = p2[1] - p1[1]
-    dz = p2[2] - p1[2]
+    # Line of sight - use free space path loss
+    # FSPL(dB) = 20log10(d) + 20log10(f) - 147.55
+    fspl_dB = 20 * np.log10(distance) + 20 * np.log10(frequency) - 147.55
     
-    # Total distance
-    dist = math.sqrt(dx**2 + dy**2 + dz**2)
+    # Non-line of sight - use simplified COST231 model
+    # Basic model: NLOS loss = FSPL + 20 + 30log10(d/100)
+    nlos_loss = 20 + 30 * np.log10(np.maximum(distance / 100, 0.1))
     
-    for building in buildings:
-        # Check if line intersects with building footprint
-        if line.intersects(building['polygon']):
-            # Skip if line only touches the polygon edge
-            if line.touches(building['polygon']):
-                continue
-                
-            # Get intersection points with the building polygon
-            intersection = line.intersection(building['polygon'].boundary)
-            
-            # If intersection is a point or multipoint, check each intersection
-            if intersection.geom_type == 'Point':
-                points = [intersection]
-            elif intersection.geom_type == 'MultiPoint':
-                points = list(intersection.geoms)
-            else:
-                # For more complex intersections, simplify and take first/last points
-                points = [Point(line.coords[0]), Point(line.coords[-1])]
-            
-            for point in points:
-                # Calculate how far along the line the intersection occurs
-                t_x = (point.x - p1[0]) / dx if dx != 0 else 0
-                t_y = (point.y - p1[1]) / dy if dy != 0 else 0
-                
-                # Use average t value for more stable calculation
-                t_values = [v for v in [t_x, t_y] if v != 0]
-                if not t_values:
-                    continue
-                    
-                t = sum(t_values) / len(t_values)
-                
-                # Calculate z at intersection
-                z_intersect = p1[2] + t * dz
-                
-                # If intersection is below building height, path is blocked
-                if 0 <= t <= 1 and z_intersect < building['height']:
-                    return False
+    return np.where(has_los, fspl_dB, fspl_dB + nlos_loss)
+
+def calculate_cqi_array(snr_dB):
+    """Array version of calculate_cqi: map SNR values (dB) to CQI 1-15."""
+    # Define SNR thresholds for CQI mapping
+    min_snr = -10.0  # SNR value corresponding to CQI 1
+    max_snr = 30.0   # SNR value corresponding to CQI 15
+    
+    # Clamp SNR to the defined range and normalize to [0,1]
+    snr_clamped = np.clip(np.asarray(snr_dB, dtype=float), min_snr, max_snr)
+    normalized = (snr_clamped - min_snr) / (max_snr - min_snr)
+    
+    # Scale to CQI range [1,15] and round to nearest integer
+    return np.round(1 + normalized * 14).astype(np.int64)
+
+def calculate_link_budget(distance, has_los, tx_power_dBm=30, frequency=FREQUENCY_HZ,
+                          bandwidth=BANDWIDTH_HZ, noise_figure_dB=NOISE_FIGURE_DB, path_loss_dB=None):
+    """
+    Path loss, RX power, SNR and CQI for arrays of links in one pass.
+    All arguments broadcast, so radio parameters can be swept by passing arrays
+    shaped to broadcast against the distance/LOS arrays.
+    A precomputed path_loss_dB (e.g. from a propagation engine) replaces the built-in model.
+    """
+    if path_loss_dB is None:
+        path_loss_dB = calculate_path_loss_array(distance, frequency, has_los)
+    rx_power_dBm = tx_power_dBm - path_loss_dB
+    snr_dB = rx_power_dBm - calculate_noise_floor(bandwidth, noise_figure_dB)
     
-    return True
+    return {
+        'path_loss_dB': path_loss_dB,
+        'rx_power_dBm': rx_power_dBm,
+        'snr_dB': snr_dB,
+        'cqi': calculate_cqi_array(snr_dB)
+    }
 
 def calculate_path_loss(tx_position, rx_position, frequency, has_los):
     """Calculate path loss using appropriate propagation models."""
@@ -224,21 +792,7 @@ def calculate_path_loss(tx_position, rx_position, frequency, has_los):
         (tx_position[2] - rx_position[2])**2
     )
     
-    # Avoid division by zero or very small distances
-    distance = max(distance, 1.0)
-    
-    if has_los:
-        # Line of sight - use free space path loss
-        # FSPL(dB) = 20log10(d) + 20log10(f) - 147.55
-        path_loss_dB = 20 * math.log10(distance) + 20 * math.log10(frequency) - 147.55
-    else:
-        # Non-line of sight - use simplified COST231 model
-        # Basic model: NLOS loss = FSPL + 20 + 30log10(d/100)
-        fspl_dB = 20 * math.log10(distance) + 20 * math.log10(frequency) - 147.55
-        nlos_loss = 20 + 30 * math.log10(max(distance/100, 0.1))
-        path_loss_dB = fspl_dB + nlos_loss
-    
-    return path_loss_dB
+    return float(calculate_path_loss_array(distance, frequency, has_los))
 
 def calculate_cqi(snr_dB):
     """
@@ -247,306 +801,1493 @@ def calculate_cqi(snr_dB):
     - CQI 1: Worst channel quality (low SNR)
     - CQI 15: Best channel quality (high SNR)
     """
-    # Define SNR thresholds for CQI mapping
-    # These values can be adjusted based on specific system requirements
-    min_snr = -10.0  # SNR value corresponding to CQI 1
-    max_snr = 30.0   # SNR value corresponding to CQI 15
+    return int(calculate_cqi_array(snr_dB))
+
+# Propagation engines ==============================================================
+SPEED_OF_LIGHT = 299792458.0  # m/s
+REFLECTION_LOSS_DB = 6.0  # Loss per specular wall reflection
+REFLECTION_OFFSET = 1e-4  # Reflection points are pushed this far (m) off the wall
+
+def _wall_crossings(starts, ends, index):
+    """
+    Wall crossings of arbitrary segments, as (segment, wall, t) index arrays.
+    starts and ends are (N,3) arrays; t is 0 at the start and 1 at the end.
+    """
+    coords = np.stack([starts[:, :2], ends[:, :2]], axis=1)
+    seg_idx, building_idx = index['tree'].query(shapely.linestrings(coords))
+    edges = index['edges']
+    pair_seg, pair_edge = _expand_to_edges(seg_idx, building_idx, edges['offsets'])
+    crossed, t = _ray_edge_crossings(
+        (starts[pair_seg, 0], starts[pair_seg, 1]), ends[pair_seg, 0], ends[pair_seg, 1],
+        edges['x1'][pair_edge], edges['y1'][pair_edge], edges['x2'][pair_edge], edges['y2'][pair_edge]
+    )
+    return pair_seg[crossed], pair_edge[crossed], t[crossed]
+
+def segments_clear(starts, ends, buildings, index):
+    """Line of sight for many independent 3D segments; the segment version of has_line_of_sight_batch."""
+    starts = np.asarray(starts, dtype=float).reshape(-1, 3)
+    ends = np.asarray(ends, dtype=float).reshape(-1, 3)
+    if len(starts) == 0 or not buildings:
+        return np.ones(len(starts), dtype=bool)
     
-    # Clamp SNR to the defined range
-    snr_clamped = max(min_snr, min(max_snr, snr_dB))
+    pair_seg, pair_edge, t = _wall_crossings(starts, ends, index)
+    z_intersect = starts[pair_seg, 2] + t * (ends[pair_seg, 2] - starts[pair_seg, 2])
+    blocked = z_intersect < index['edges']['height'][pair_edge]
+    clear = np.bincount(pair_seg[blocked], minlength=len(starts)) == 0
+    return clear & ~points_in_prisms(starts, buildings, index) & ~points_in_prisms(ends, buildings, index)
+
+def _knife_edge_loss(v):
+    """Single knife-edge diffraction loss J(v) in dB (ITU-R P.526 approximation)."""
+    v = np.asarray(v, dtype=float)
+    v_clamped = np.maximum(v, -0.78)
+    loss = 6.9 + 20 * np.log10(np.sqrt((v_clamped - 0.1)**2 + 1) + v_clamped - 0.1)
+    return np.where(v > -0.78, loss, 0.0)
+
+def path_loss_simple(tx_position, rx_positions, buildings, los, index=None, frequency=FREQUENCY_HZ):
+    """Default model: free-space loss with LOS, plus the COST231-style penalty without."""
+    distance = np.linalg.norm(rx_positions - np.asarray(tx_position, dtype=float), axis=1)
+    return calculate_path_loss_array(distance, frequency, los)
+
+def path_loss_knife_edge(tx_position, rx_positions, buildings, los, index=None, frequency=FREQUENCY_HZ):
+    """
+    Free-space loss plus single knife-edge diffraction over the dominant obstruction.
+    Every wall the ray crosses is a candidate edge at its roof height; the one with the
+    largest Fresnel-Kirchhoff parameter v sets the loss. Receivers blocked without a
+    crossing below a roof (endpoint inside a building) keep the default NLOS model.
+    """
+    index = index if index is not None else build_spatial_index(buildings)
+    tx = np.asarray(tx_position, dtype=float)
+    distance = np.linalg.norm(rx_positions - tx, axis=1)
+    wavelength = SPEED_OF_LIGHT / frequency
     
-    # Normalize to [0,1] range
-    normalized = (snr_clamped - min_snr) / (max_snr - min_snr)
+    # Obstacle height above the ray at every wall crossing, and distances to both ends
+    pair_ray, pair_edge, t = _wall_crossings(np.broadcast_to(tx, rx_positions.shape), rx_positions, index)
+    h = index['edges']['height'][pair_edge] - (tx[2] + t * (rx_positions[pair_ray, 2] - tx[2]))
+    d1 = np.maximum(t * distance[pair_ray], 1.0)
+    d2 = np.maximum((1 - t) * distance[pair_ray], 1.0)
+    v = h * np.sqrt(2 / wavelength * (d1 + d2) / (d1 * d2))
     
-    # Scale to CQI range [1,15] and round to nearest integer
-    cqi = round(1 + normalized * 14)
+    # Dominant edge per receiver
+    v_max = np.full(len(rx_positions), -np.inf)
+    np.maximum.at(v_max, pair_ray, v)
     
-    return cqi
+    path_loss_dB = calculate_path_loss_array(distance, frequency, True) + _knife_edge_loss(v_max)
+    roof_only = ~los & (v_max <= 0)
+    return np.where(roof_only, calculate_path_loss_array(distance, frequency, False), path_loss_dB)
 
-def generate_user_request():
-    """Generate a random user request from a predefined list with assigned labels."""
-    # Define requests with their labels
-    user_requests = [
-        # High bandwidth, high reliability applications (eMBB)
-        ("I want to watch 4K video", "eMBB"),
-        ("I want to stream a live sports event in HD", "eMBB"),
-        ("I need to participate in a video conference meeting", "eMBB"),
-        ("I want to use augmented reality navigation", "eMBB"),
-        ("I want to participate in a virtual reality gaming session", "eMBB"),
-        ("I need to stream 8K video content", "eMBB"),
-        ("I want to download a big game file", "eMBB"),
-        ("I need AI-based video analytics", "eMBB"),
-        ("I want to use holographic communication", "eMBB"),
+def _reflection_walls(tx, index):
+    """
+    Walls whose outer face looks at the TX, with outward unit normals and the TX image in each.
+    Returns a dict of per-wall arrays ('edge' indexes the wall table), or None if there are none.
+    """
+    edges = index['edges']
+    if len(edges['height']) == 0:
+        return None
+    
+    # Outward unit normals from the ring orientation (signed area of each footprint)
+    ex = edges['x2'] - edges['x1']
+    ey = edges['y2'] - edges['y1']
+    length = np.maximum(np.hypot(ex, ey), 1e-12)
+    area = np.bincount(edges['building'], weights=edges['x1'] * edges['y2'] - edges['x2'] * edges['y1'])
+    orientation = np.where(area[edges['building']] > 0, 1.0, -1.0)
+    nx = orientation * ey / length
+    ny = -orientation * ex / length
+    
+    # Only walls whose outer face looks at the TX can reflect it
+    side_tx = (tx[0] - edges['x1']) * nx + (tx[1] - edges['y1']) * ny
+    walls = np.nonzero(side_tx > 0)[0]
+    if len(walls) == 0:
+        return None
+    side_tx = side_tx[walls]
+    return {
+        'edge': walls,
+        'x1': edges['x1'][walls], 'y1': edges['y1'][walls],
+        'wx': ex[walls], 'wy': ey[walls], 'wl': length[walls],
+        'nx': nx[walls], 'ny': ny[walls],
+        'side_tx': side_tx,
+        'height': edges['height'][walls],
+        'image_x': tx[0] - 2 * side_tx * nx[walls],
+        'image_y': tx[1] - 2 * side_tx * ny[walls]
+    }
+
+def _reflection_candidates(tx, rx_positions, walls, max_pairs=2_000_000):
+    """
+    Geometric first-order reflections, before any clearance test, in chunks of receivers.
+    Yields (start, ray, wall, points): receiver offsets within the chunk beginning at start,
+    indices into walls, and the reflection points pushed just off each wall.
+    """
+    chunk = max(1, max_pairs // len(walls['edge']))
+    x1, y1 = walls['x1'], walls['y1']
+    wnx, wny = walls['nx'], walls['ny']
+    image_x, image_y = walls['image_x'], walls['image_y']
+    for start in range(0, len(rx_positions), chunk):
+        rx = rx_positions[start:start + chunk]
+        rx_x, rx_y = rx[:, 0][:, None], rx[:, 1][:, None]
         
-        # Medium requirements (eMBB)
-        ("I want to stream music while browsing social media", "eMBB"),
-        ("I need to download large files", "eMBB"),
-        ("I want to download a large software update", "eMBB"),
-        ("I need to make a high-quality voice call", "eMBB"),
-        ("I want to stream a webinar with interactive features", "eMBB"),
-        ("I need to use cloud-based AI services for image processing", "eMBB"),
-        ("I need real-time traffic updates for navigation", "eMBB"),
-        ("I want to monitor my home security cameras remotely", "eMBB"),
-        ("I want to remotely access my work computer", "eMBB"),
-        ("I want to browse websites and check email", "eMBB"),
-        ("I need to send text messages and use messaging apps", "eMBB"),
-        ("I want to update my social media status", "eMBB"),
-        ("I need to check weather forecasts", "eMBB"),
-        ("I want to read news articles online", "eMBB"),
-        ("I need to use maps for basic navigation", "eMBB"),
-        ("I want to listen to low-quality audio streaming", "eMBB"),
-        ("I need to sync my calendar and contacts", "eMBB"),
+        # Fraction s of the unfolded path at which it meets the wall line
+        side_rx = (rx_x - x1) * wnx + (rx_y - y1) * wny
+        s = walls['side_tx'] / np.where(side_rx > 0, walls['side_tx'] + side_rx, 1.0)
+        px = image_x + s * (rx_x - image_x)
+        py = image_y + s * (rx_y - image_y)
+        u = ((px - x1) * walls['wx'] + (py - y1) * walls['wy']) / walls['wl']**2
+        pz = tx[2] + s * (rx[:, 2][:, None] - tx[2])
+        valid = (side_rx > 0) & (u >= 0) & (u <= 1) & (pz < walls['height'])
         
-        # Lower requirements (URLLC)
-        ("I need to control a robotic arm in real time", "URLLC"),
-        ("I need my autonomous vehicle to communicate in real time", "URLLC"),  
-        ("I need to participate in an online multiplayer game", "URLLC"),       
-        ("I want to use remote surgery equipment", "URLLC"),
-        ("I need to monitor IoT sensors in real-time", "URLLC"),
-        ("I want to play competitive mobile games with ultra-low latency", "URLLC"),
-        ("I need to synchronize multiple robots on a factory floor", "URLLC"),
-        ("I need to monitor and control critical manufacturing processes in real-time", "URLLC"),  
-        ("I need immediate machine shutdown capability for safety incidents", "URLLC"),       
-        ("I need to control precision CNC machines with zero tolerance for delay", "URLLC"),
-        ("I need to transmit real-time patient vital signs during critical care", "URLLC"),
-        ("I need reliable connectivity for implanted medical devices", "URLLC"),       
-        ("I need instant alerts for life-threatening patient conditions", "URLLC"),
-        ("I need to control remote diagnostic equipment in rural clinics", "URLLC"),  
-        ("I need emergency response coordination during a disaste", "URLLC"),       
-        ("I need to deploy early warning systems for natural disasters", "URLLC"),
-        ("I need reliable communication for firefighters inside buildings", "URLLC"),
-        ("I need instant facial recognition for public security threats", "URLLC"),          
-        ("I need microsecond-level latency for high-frequency tradin", "URLLC"),       
-        ("I need real-time fraud detection for financial transactions", "URLLC"),
-        ("I need to synchronize distributed financial ledgers instantly", "URLLC"),  
-        ("I need to detect and isolate power grid faults instantly", "URLLC"),       
-        ("I need to balance electrical load in real-time across microgrids", "URLLC"),
-        ("I need to control critical infrastructure with zero downtime", "URLLC"),
-        ("I need vehicle-to-vehicle collision avoidance systems", "URLLC"),                        
-    ]
+        ray, wall = np.nonzero(valid)
+        if len(ray) == 0:
+            continue
+        points = np.column_stack([
+            px[ray, wall] + REFLECTION_OFFSET * wnx[wall],
+            py[ray, wall] + REFLECTION_OFFSET * wny[wall],
+            pz[ray, wall]
+        ])
+        yield start, ray, wall, points
+
+def path_loss_reflection(tx_position, rx_positions, buildings, los, index=None, frequency=FREQUENCY_HZ,
+                         max_pairs=2_000_000):
+    """
+    Default model for the direct path plus first-order specular reflections off building walls.
+    Each wall mirrors the TX into an image source, and the reflection point is where the
+    image-to-RX line meets the wall. A reflection counts if it hits the outer face below
+    the wall top and both legs are clear. It adds free-space loss over the unfolded
+    length plus REFLECTION_LOSS_DB. All paths are summed in power.
+    """
+    index = index if index is not None else build_spatial_index(buildings)
+    tx = np.asarray(tx_position, dtype=float)
+    gain = 10 ** (-path_loss_simple(tx_position, rx_positions, buildings, los, index, frequency) / 10)
+    walls = _reflection_walls(tx, index) if len(rx_positions) else None
+    if walls is None:
+        return -10 * np.log10(gain)
+    
+    for start, ray, wall, points in _reflection_candidates(tx, rx_positions, walls, max_pairs):
+        # Both legs must be clear; the reflection point sits just off the wall
+        rx = rx_positions[start + ray]
+        clear = (segments_clear(np.broadcast_to(tx, points.shape), points, buildings, index)
+                 & segments_clear(points, rx, buildings, index))
+        ray, wall, rx = ray[clear], wall[clear], rx[clear]
+        
+        unfolded = np.sqrt((rx[:, 0] - walls['image_x'][wall])**2 + (rx[:, 1] - walls['image_y'][wall])**2
+                           + (rx[:, 2] - tx[2])**2)
+        loss_dB = calculate_path_loss_array(unfolded, frequency, True) + REFLECTION_LOSS_DB
+        np.add.at(gain, start + ray, 10 ** (-loss_dB / 10))
+    
+    return -10 * np.log10(gain)
+
+# Engines share the signature (tx_position, rx_positions, buildings, los, index, frequency)
+PROPAGATION_ENGINES = {
+    'simple': path_loss_simple,
+    'knife_edge': path_loss_knife_edge,
+    'reflection': path_loss_reflection
+}
+
+def run_propagation_engine(engine, tx_position, rx_positions, buildings, frequency=FREQUENCY_HZ,
+                           index=None, los=None):
+    """
+    Path loss for every receiver from a named engine, together with its measured cost.
+    Returns a dict with 'path_loss_dB', 'has_los', 'seconds' and 'seconds_per_rx'.
+    A precomputed los can be shared between engines; its cost is then not counted.
+    """
+    rx_positions = np.asarray(rx_positions, dtype=float).reshape(-1, 3)
+    start = time.perf_counter()
+    if los is None:
+        los = has_line_of_sight_batch(tx_position, rx_positions, buildings, index=index)
+    path_loss_dB = PROPAGATION_ENGINES[engine](tx_position, rx_positions, buildings, los, index, frequency)
+    seconds = time.perf_counter() - start
+    
+    return {
+        'path_loss_dB': path_loss_dB,
+        'has_los': los,
+        'seconds': seconds,
+        'seconds_per_rx': seconds / max(len(rx_positions), 1)
+    }
+
+# User requests with their slice labels
+USER_REQUESTS = [
+    # High bandwidth, high reliability applications (eMBB)
+    ("I want to watch 4K video", "eMBB"),
+    ("I want to stream a live sports event in HD", "eMBB"),
+    ("I need to participate in a video conference meeting", "eMBB"),
+    ("I want to use augmented reality navigation", "eMBB"),
+    ("I want to participate in a virtual reality gaming session", "eMBB"),
+    ("I need to stream 8K video content", "eMBB"),
+    ("I want to download a big game file", "eMBB"),
+    ("I need AI-based video analytics", "eMBB"),
+    ("I want to use holographic communication", "eMBB"),
     
+    # Medium requirements (eMBB)
+    ("I want to stream music while browsing social media", "eMBB"),
+    ("I need to download large files", "eMBB"),
+    ("I want to download a large software update", "eMBB"),
+    ("I need to make a high-quality voice call", "eMBB"),
+    ("I want to stream a webinar with interactive features", "eMBB"),
+    ("I need to use cloud-based AI services for image processing", "eMBB"),
+    ("I need real-time traffic updates for navigation", "eMBB"),
+    ("I want to monitor my home security cameras remotely", "eMBB"),
+    ("I want to remotely access my work computer", "eMBB"),
+    ("I want to browse websites and check email", "eMBB"),
+    ("I need to send text messages and use messaging apps", "eMBB"),
+    ("I want to update my social media status", "eMBB"),
+    ("I need to check weather forecasts", "eMBB"),
+    ("I want to read news articles online", "eMBB"),
+    ("I need to use maps for basic navigation", "eMBB"),
+    ("I want to listen to low-quality audio streaming", "eMBB"),
+    ("I need to sync my calendar and contacts", "eMBB"),
+    
+    # Lower requirements (URLLC)
+    ("I need to control a robotic arm in real time", "URLLC"),
+    ("I need my autonomous vehicle to communicate in real time", "URLLC"),  
+    ("I need to participate in an online multiplayer game", "URLLC"),       
+    ("I want to use remote surgery equipment", "URLLC"),
+    ("I need to monitor IoT sensors in real-time", "URLLC"),
+    ("I want to play competitive mobile games with ultra-low latency", "URLLC"),
+    ("I need to synchronize multiple robots on a factory floor", "URLLC"),
+    ("I need to monitor and control critical manufacturing processes in real-time", "URLLC"),  
+    ("I need immediate machine shutdown capability for safety incidents", "URLLC"),       
+    ("I need to control precision CNC machines with zero tolerance for delay", "URLLC"),
+    ("I need to transmit real-time patient vital signs during critical care", "URLLC"),
+    ("I need reliable connectivity for implanted medical devices", "URLLC"),       
+    ("I need instant alerts for life-threatening patient conditions", "URLLC"),
+    ("I need to control remote diagnostic equipment in rural clinics", "URLLC"),  
+    ("I need emergency response coordination during a disaste", "URLLC"),       
+    ("I need to deploy early warning systems for natural disasters", "URLLC"),
+    ("I need reliable communication for firefighters inside buildings", "URLLC"),
+    ("I need instant facial recognition for public security threats", "URLLC"),          
+    ("I need microsecond-level latency for high-frequency tradin", "URLLC"),       
+    ("I need real-time fraud detection for financial transactions", "URLLC"),
+    ("I need to synchronize distributed financial ledgers instantly", "URLLC"),  
+    ("I need to detect and isolate power grid faults instantly", "URLLC"),       
+    ("I need to balance electrical load in real-time across microgrids", "URLLC"),
+    ("I need to control critical infrastructure with zero downtime", "URLLC"),
+    ("I need vehicle-to-vehicle collision avoidance systems", "URLLC"),                        
+]
+
+def generate_user_request():
+    """Generate a random user request from a predefined list with assigned labels."""
     # Select a random request and its label
-    request, label = random.choice(user_requests)
+    request, label = random.choice(USER_REQUESTS)
     
     return request, label
 
-def perform_ray_tracing(tx_position, rx_positions, buildings, tx_power_dBm=30):
-    """Perform simplified ray tracing to calculate SNR and CQI at each receiver."""
-    # Simulation parameters
-    frequency = 2.4e9  # 2.4 GHz (in Hz)
-    bandwidth = 20e6  # 20 MHz
+def _trace_receivers(tx_position, rx_positions, buildings, tx_power_dBm=30, index=None, engine='simple',
+                     profile=None):
+    """Compute LOS, RX power, SNR and CQI columns for a set of receivers."""
+    rx_positions = np.asarray(rx_positions, dtype=float).reshape(-1, 3)
+    
+    # Check line of sight for all receivers in one vectorized pass
+    with profile_stage(profile, 'los') as stage:
+        los_flags = has_line_of_sight_batch(tx_position, rx_positions, buildings, index=index)
+        stage['receivers'] = len(rx_positions)
+        stage['los_receivers'] = int(los_flags.sum())
+    
+    # Link budget for all receivers at once
+    with profile_stage(profile, 'path_loss') as stage:
+        distance = np.linalg.norm(rx_positions - np.asarray(tx_position, dtype=float), axis=1)
+        path_loss_dB = PROPAGATION_ENGINES[engine](tx_position, rx_positions, buildings, los_flags, index)
+        budget = calculate_link_budget(distance, los_flags, tx_power_dBm, path_loss_dB=path_loss_dB)
+        stage['engine'] = engine
+    
+    return {
+        'has_los': los_flags,
+        'rx_power_dBm': budget['rx_power_dBm'],
+        'snr_dB': budget['snr_dB'],
+        'cqi': budget['cqi']
+    }
+
+def _trace_receivers_multi_tx(tx_positions, rx_positions, buildings, tx_power_dBm=30, index=None):
+    """
+    Trace every TX-RX pair as a (K, N) batch and associate each receiver with its best server.
+    The serving cell is the TX with the highest received power; SINR treats every
+    other TX as co-channel interference.
+    """
+    tx_positions = np.asarray(tx_positions, dtype=float).reshape(-1, 3)
+    rx_positions = np.asarray(rx_positions, dtype=float).reshape(-1, 3)
+    tx_power_dBm = np.broadcast_to(np.asarray(tx_power_dBm, dtype=float), (len(tx_positions),))
     
-    # Noise calculation
-    thermal_noise_dBm = -174 + 10 * math.log10(bandwidth)  # -174 dBm/Hz + 10log10(bandwidth)
-    noise_figure_dB = 8  # Typical receiver noise figure
-    noise_floor_dBm = thermal_noise_dBm + noise_figure_dB
+    # (K, N) LOS matrix, one batched pass per transmitter
+    los = np.array([
+        has_line_of_sight_batch(tx_position, rx_positions, buildings, index=index)
+        for tx_position in tx_positions
+    ]).reshape(len(tx_positions), len(rx_positions))
     
+    # (K, N) link budget
+    distance = np.linalg.norm(rx_positions[None, :, :] - tx_positions[:, None, :], axis=2)
+    budget = calculate_link_budget(distance, los, tx_power_dBm[:, None])
+    
+    # Best-server association
+    serving = np.argmax(budget['rx_power_dBm'], axis=0)
+    receivers = np.arange(len(rx_positions))
+    serving_power_dBm = budget['rx_power_dBm'][serving, receivers]
+    
+    # SINR with all other transmitters as interference (linear mW)
+    power_mW = 10 ** (budget['rx_power_dBm'] / 10)
+    interference_mW = power_mW.sum(axis=0) - power_mW[serving, receivers]
+    noise_mW = 10 ** (calculate_noise_floor(BANDWIDTH_HZ, NOISE_FIGURE_DB) / 10)
+    sinr_dB = serving_power_dBm - 10 * np.log10(interference_mW + noise_mW)
+    
+    return {
+        'has_los': los[serving, receivers],
+        'rx_power_dBm': serving_power_dBm,
+        'snr_dB': budget['snr_dB'][serving, receivers],
+        'sinr_dB': sinr_dB,
+        # CQI follows SINR, which equals SNR when there is a single TX
+        'cqi': calculate_cqi_array(sinr_dB),
+        'serving_cell': serving + 1
+    }
+
+def _assemble_results(rx_positions, columns):
+    """Turn traced columns into per-receiver result dicts, drawing user requests in RX order."""
     results = []
-    for rx_position in rx_positions:
-        # Check if line of sight exists
-        los = has_line_of_sight(tx_position, rx_position, buildings)
-        
-        # Calculate path loss
-        path_loss_dB = calculate_path_loss(tx_position, rx_position, frequency, los)
-        
-        # Calculate received power
-        rx_power_dBm = tx_power_dBm - path_loss_dB
-        
-        # Calculate SNR
-        snr_dB = rx_power_dBm - noise_floor_dBm
-        
-        # Calculate CQI
-        cqi = calculate_cqi(snr_dB)
-        
+    for i, rx_position in enumerate(rx_positions):
         # Generate a random user request with its label
         user_request, request_label = generate_user_request()
         
-        results.append({
+        result = {
             'position': rx_position,
-            'snr_dB': snr_dB,
-            'has_los': los,
-            'rx_power_dBm': rx_power_dBm,
-            'cqi': cqi,
+            'snr_dB': float(columns['snr_dB'][i]),
+            'has_los': bool(columns['has_los'][i]),
+            'rx_power_dBm': float(columns['rx_power_dBm'][i]),
+            'cqi': int(columns['cqi'][i]),
             'user_request': user_request,
             'request_label': request_label
-        })
+        }
+        # Multi-cell runs also carry the serving cell and SINR
+        if 'serving_cell' in columns:
+            result['serving_cell'] = int(columns['serving_cell'][i])
+            result['sinr_dB'] = float(columns['sinr_dB'][i])
+        
+        results.append(result)
     
     return results
 
-def main():
-    # File path
-    file_path = r"C:\Users\Jingwen TONG\Desktop\我的文档\02_项目_202301\16-WirelessAgent-ChinaCom\Simulations\WirelessAgent_LangGraph\Knowledge_Base\HKUST_F.osm"
+def perform_ray_tracing(tx_position, rx_positions, buildings, tx_power_dBm=30, index=None, engine='simple',
+                        profile=None):
+    """
+    Perform simplified ray tracing to calculate SNR and CQI at each receiver.
+    engine names the propagation model in PROPAGATION_ENGINES. With profile the
+    LOS, path loss and result assembly stages are recorded.
+    """
+    columns = _trace_receivers(tx_position, rx_positions, buildings, tx_power_dBm, index, engine, profile)
+    with profile_stage(profile, 'results'):
+        return _assemble_results(rx_positions, columns)
+
+def perform_multi_tx_ray_tracing(tx_positions, rx_positions, buildings, tx_power_dBm=30, index=None):
+    """
+    Ray tracing with K transmitters and best-server association.
+    tx_power_dBm may be a scalar or one value per TX. Results carry 'serving_cell'
+    (1-based index into tx_positions) and 'sinr_dB'; CQI is derived from SINR.
+    """
+    columns = _trace_receivers_multi_tx(tx_positions, rx_positions, buildings, tx_power_dBm, index)
+    return _assemble_results(rx_positions, columns)
+
+# Per-process state of parallel tracing workers
+_WORKER_STATE = {}
+
+def _init_tracing_worker(buildings):
+    """Process-pool initializer: receive the buildings once and build the spatial index locally."""
+    _WORKER_STATE['buildings'] = buildings
+    _WORKER_STATE['index'] = build_spatial_index(buildings)
+
+def _trace_chunk(tx_position, rx_chunk, tx_power_dBm, engine='simple'):
+    """Trace one receiver chunk against the worker's buildings."""
+    return _trace_receivers(tx_position, rx_chunk, _WORKER_STATE['buildings'], tx_power_dBm,
+                            _WORKER_STATE['index'], engine)
+
+def _trace_map_chunk(map_file, cache_dir, tx_position, rx_chunk, tx_power_dBm, engine='simple'):
+    """Trace one receiver chunk of map_file; each worker loads a map (from the geometry cache) once."""
+    if _WORKER_STATE.get('map_key') != (map_file, cache_dir):
+        buildings, _, _ = load_buildings(map_file, cache_dir)
+        _init_tracing_worker(buildings)
+        _WORKER_STATE['map_key'] = (map_file, cache_dir)
+    return _trace_chunk(tx_position, rx_chunk, tx_power_dBm, engine)
+
+def perform_ray_tracing_parallel(tx_position, rx_positions, buildings, tx_power_dBm=30, workers=None,
+                                 chunks_per_worker=4, executor=None, engine='simple', map_file=None,
+                                 cache_dir=None):
+    """
+    Parallel version of perform_ray_tracing that shards receivers across a process pool.
+    Buildings are sent to each worker once through the pool initializer. Chunks are merged
+    in RX order and user requests are drawn in the parent, so the output is identical to
+    the serial run. An existing executor set up with _init_tracing_worker can be passed in.
+    With map_file (the OSM file buildings were loaded from) workers load the map
+    themselves from the geometry cache instead, so one plain pool can serve a batch of maps.
+    """
+    rx_positions = np.asarray(rx_positions, dtype=float).reshape(-1, 3)
+    workers = workers or os.cpu_count() or 1
+    
+    # Not worth the pool start-up for a single worker or a handful of receivers
+    if executor is None and (workers <= 1 or len(rx_positions) < 2 * workers):
+        return perform_ray_tracing(tx_position, rx_positions, buildings, tx_power_dBm, engine=engine)
+    
+    num_chunks = min(len(rx_positions), workers * chunks_per_worker) or 1
+    chunks = np.array_split(rx_positions, num_chunks)
     
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_tracing_worker, initargs=(buildings,)
+        )
     try:
-        # Parse buildings from OSM
-        buildings = parse_osm_buildings(file_path)
-        print(f"Found {len(buildings)} buildings in OSM file")
-        
-        if not buildings:
-            print("No buildings found in the OSM file. Please check the file content.")
-            return
-        
-        # Convert to Cartesian coordinates
-        cartesian_buildings, transformer, (ref_lat, ref_lon) = convert_to_cartesian(buildings)
-        
-        # Find tallest building
-        tallest_building = find_tallest_building(cartesian_buildings)
-        if not tallest_building:
-            print("No valid buildings found for analysis")
-            return
-        
-        print(f"Tallest building height: {tallest_building['height']} meters")
-        
-        # Place TX at tallest building
-        tx_position = place_tx(tallest_building)
-        print(f"TX position: ({tx_position[0]:.2f}, {tx_position[1]:.2f}, {tx_position[2]:.2f}) m")
-        
-        # Calculate scene bounds
-        all_nodes = [node for building in cartesian_buildings for node in building['nodes']]
-        min_x = min(node[0] for node in all_nodes)
-        max_x = max(node[0] for node in all_nodes)
-        min_y = min(node[1] for node in all_nodes)
-        max_y = max(node[1] for node in all_nodes)
-        
-        # Add some buffer to bounds
-        buffer = max((max_x - min_x), (max_y - min_y)) * 0.1
-        bounds = (min_x - buffer, max_x + buffer, min_y - buffer, max_y + buffer)
-        
-        # Generate random RX positions=======================================================================================================
-        rx_positions = generate_rx_positions(bounds, 30, cartesian_buildings) # Number of RX positions is 30
-        
-        # Perform ray tracing
-        results = perform_ray_tracing(tx_position, rx_positions, cartesian_buildings)
+        if map_file is not None:
+            futures = [executor.submit(_trace_map_chunk, map_file, cache_dir, tx_position, chunk, tx_power_dBm, engine)
+                       for chunk in chunks]
+        else:
+            futures = [executor.submit(_trace_chunk, tx_position, chunk, tx_power_dBm, engine) for chunk in chunks]
+        # Collect in submission order so rows stay in RX_ID order
+        parts = [future.result() for future in futures]
+    finally:
+        if own_executor:
+            executor.shutdown()
+    
+    columns = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+    return _assemble_results(rx_positions, columns)
+
+def _building_keys(buildings):
+    """
+    Diff keys for a building set: the OSM way id, or a hash of the outline for buildings
+    without one. Each key carries an occurrence count, so duplicates never collapse.
+    """
+    keys = []
+    seen = {}
+    for building in buildings:
+        key = building.get('id')
+        if key is None:
+            # Rounded to the mm; adding 0.0 folds -0.0 into 0.0 before hashing
+            nodes = np.round(np.asarray(building['nodes'], dtype=float), 3) + 0.0
+            key = ('outline', hashlib.sha1(nodes.tobytes()).hexdigest())
+        seen[key] = seen.get(key, 0) + 1
+        keys.append((key, seen[key]))
+    return keys
+
+def diff_buildings(old_buildings, new_buildings):
+    """
+    Compare two versions of a building set by OSM way id (outline hash for buildings without one).
+    Returns a dict with 'added' and 'removed' building lists and 'changed' (old, new)
+    pairs whose height or outline differs.
+    """
+    old_by_key = dict(zip(_building_keys(old_buildings), old_buildings))
+    new_by_key = dict(zip(_building_keys(new_buildings), new_buildings))
+    
+    changed = []
+    for key in old_by_key.keys() & new_by_key.keys():
+        old, new = old_by_key[key], new_by_key[key]
+        old_nodes = np.asarray(old['nodes'], dtype=float)
+        new_nodes = np.asarray(new['nodes'], dtype=float)
+        if (old['height'] != new['height'] or old_nodes.shape != new_nodes.shape
+                or not np.allclose(old_nodes, new_nodes, rtol=0, atol=1e-6)):
+            changed.append((old, new))
+    
+    return {
+        'added': [new_by_key[key] for key in new_by_key.keys() - old_by_key.keys()],
+        'removed': [old_by_key[key] for key in old_by_key.keys() - new_by_key.keys()],
+        'changed': changed
+    }
+
+def _rays_through(starts, ends, footprints):
+    """Indices of the 2D segments starts->ends that touch any of the footprints (an STRtree)."""
+    coords = np.stack([starts[:, :2], ends[:, :2]], axis=1)
+    seg_idx, _ = footprints.query(shapely.linestrings(coords), predicate='intersects')
+    return seg_idx
+
+def find_affected_receivers(tx_position, rx_positions, diff, engine='simple', old_index=None, new_index=None):
+    """
+    Indices of receivers whose result can change under a map diff.
+    For 'simple' and 'knife_edge' (which only looks at walls on the direct ray) these are the
+    receivers whose TX->RX ray passes through a footprint touched by the diff (added, removed,
+    or the old or new outline of a changed building). For 'reflection' they also include every
+    receiver with a reflection candidate, in the old or new map, off a changed building or
+    with a leg through a changed footprint; this needs old_index and new_index.
+    """
+    if engine not in PROPAGATION_ENGINES:
+        raise ValueError(f"Unknown propagation engine: {engine}")
+    
+    rx_positions = np.asarray(rx_positions, dtype=float).reshape(-1, 3)
+    touched = diff['added'] + diff['removed'] + [building for pair in diff['changed'] for building in pair]
+    if not touched or len(rx_positions) == 0:
+        return np.empty(0, dtype=np.int64)
+    if engine == 'reflection' and (old_index is None or new_index is None):
+        raise ValueError("The reflection engine needs old_index and new_index to find affected receivers")
+    
+    tx = np.asarray(tx_position, dtype=float)
+    footprints = STRtree([building['polygon'] for building in touched])
+    affected = [_rays_through(np.broadcast_to(tx, rx_positions.shape), rx_positions, footprints)]
+    
+    if engine == 'reflection':
+        touched_polygons = {id(building['polygon']) for building in touched}
+        for index in (old_index, new_index):
+            walls = _reflection_walls(tx, index)
+            if walls is None:
+                continue
+            touched_buildings = np.fromiter((id(polygon) in touched_polygons for polygon in index['polygons']),
+                                            dtype=bool, count=len(index['polygons']))
+            touched_walls = touched_buildings[index['edges']['building'][walls['edge']]]
+            for start, ray, wall, points in _reflection_candidates(tx, rx_positions, walls):
+                legs = np.concatenate([
+                    _rays_through(np.broadcast_to(tx, points.shape), points, footprints),
+                    _rays_through(points, rx_positions[start + ray], footprints)
+                ])
+                affected.append(start + ray[touched_walls[wall]])
+                affected.append(start + ray[legs])
+    
+    return np.unique(np.concatenate(affected)).astype(np.int64)
+
+def retrace_changed_buildings(tx_position, rx_positions, results, old_buildings, new_buildings, index=None,
+                              tx_power_dBm=30, engine='simple', old_index=None):
+    """
+    Bring single-TX results up to date after a map edit without re-tracing everything.
+    Buildings are diffed (see diff_buildings), the receivers the edit can affect under the
+    given engine (see find_affected_receivers) are re-traced against new_buildings, and only
+    their rows are rewritten. index and old_index, if given, must be built from new_buildings
+    and old_buildings. results may be the list from perform_ray_tracing or a typed table;
+    user requests are kept. The TX position is taken as given, so move it first if its own
+    building changed. Returns the indices of the rewritten rows.
+    """
+    rx_positions = np.asarray(rx_positions, dtype=float).reshape(-1, 3)
+    diff = diff_buildings(old_buildings, new_buildings)
+    if engine == 'reflection' and (diff['added'] or diff['removed'] or diff['changed']):
+        index = index if index is not None else build_spatial_index(new_buildings)
+        old_index = old_index if old_index is not None else build_spatial_index(old_buildings)
+    affected = find_affected_receivers(tx_position, rx_positions, diff, engine, old_index, index)
+    if len(affected) == 0:
+        return affected
+    
+    columns = _trace_receivers(tx_position, rx_positions[affected], new_buildings, tx_power_dBm, index, engine)
+    
+    if isinstance(results, pd.DataFrame):
+        rows = results.index[affected]
+        results.loc[rows, 'SNR_dB'] = columns['snr_dB']
+        results.loc[rows, 'RX_Power_dBm'] = columns['rx_power_dBm']
+        results.loc[rows, 'CQI'] = np.asarray(columns['cqi'], dtype=np.int8)
+        results.loc[rows, 'LOS'] = columns['has_los']
+    else:
+        for k, i in enumerate(affected):
+            results[i]['snr_dB'] = float(columns['snr_dB'][k])
+            results[i]['has_los'] = bool(columns['has_los'][k])
+            results[i]['rx_power_dBm'] = float(columns['rx_power_dBm'][k])
+            results[i]['cqi'] = int(columns['cqi'][k])
+    
+    return affected
+
+def save_results_to_csv(results, output_path):
+    """Write ray tracing results to CSV, one row per receiver."""
+    multi_cell = bool(results) and 'serving_cell' in results[0]
+    
+    with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
+        fieldnames = ['RX_ID', 'X', 'Y', 'Z', 'SNR_dB', 'RX_Power_dBm', 'CQI', 'LOS', 'User_Request', 'Request_Label']
+        if multi_cell:
+            fieldnames += ['Serving_Cell', 'SINR_dB']
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
         
-        # Save results to CSV=============================================================================================================
-        output_path = 'ray_tracing_results.csv' # Output file path modifed by Jingwen TONG
-        with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['RX_ID', 'X', 'Y', 'Z', 'SNR_dB', 'RX_Power_dBm', 'CQI', 'LOS', 'User_Request', 'Request_Label']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+        for i, result in enumerate(results):
+            pos = result['position']
+            row = {
+                'RX_ID': i+1,
+                'X': f"{pos[0]:.2f}",
+                'Y': f"{pos[1]:.2f}",
+                'Z': f"{pos[2]:.2f}",
+                'SNR_dB': f"{result['snr_dB']:.2f}",
+                'RX_Power_dBm': f"{result['rx_power_dBm']:.2f}",
+                'CQI': result['cqi'],
+                'LOS': 1 if result['has_los'] else 0,
+                'User_Request': result['user_request'],
+                'Request_Label': result['request_label']
+            }
+            if multi_cell:
+                row['Serving_Cell'] = result['serving_cell']
+                row['SINR_dB'] = f"{result['sinr_dB']:.2f}"
+            writer.writerow(row)
+
+# Columnar formats understood by save_results, keyed by file extension
+COLUMNAR_FORMATS = {'.parquet': 'parquet', '.feather': 'feather'}
+
+def results_to_frame(results):
+    """
+    Ray tracing results as a typed DataFrame with the same columns as the CSV output.
+    Coordinates and levels keep full precision, CQI is int8, LOS is bool and the
+    request text and label are categoricals.
+    """
+    columns = {
+        'snr_dB': [result['snr_dB'] for result in results],
+        'rx_power_dBm': [result['rx_power_dBm'] for result in results],
+        'cqi': [result['cqi'] for result in results],
+        'has_los': [result['has_los'] for result in results]
+    }
+    if results and 'serving_cell' in results[0]:
+        columns['serving_cell'] = [result['serving_cell'] for result in results]
+        columns['sinr_dB'] = [result['sinr_dB'] for result in results]
+    
+    return _results_frame(
+        [result['position'] for result in results],
+        columns,
+        pd.Categorical([result['user_request'] for result in results]),
+        pd.Categorical([result['request_label'] for result in results])
+    )
+
+def _results_frame(positions, columns, user_request, request_label):
+    """Build the typed results table from traced columns and categorical request columns."""
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    frame = pd.DataFrame({
+        'RX_ID': np.arange(1, len(positions) + 1, dtype=np.int32),
+        'X': positions[:, 0],
+        'Y': positions[:, 1],
+        'Z': positions[:, 2],
+        'SNR_dB': np.asarray(columns['snr_dB'], dtype=np.float64),
+        'RX_Power_dBm': np.asarray(columns['rx_power_dBm'], dtype=np.float64),
+        'CQI': np.asarray(columns['cqi'], dtype=np.int8),
+        'LOS': np.asarray(columns['has_los'], dtype=bool),
+        'User_Request': user_request,
+        'Request_Label': request_label
+    })
+    # Multi-cell runs also carry the serving cell and SINR
+    if 'serving_cell' in columns:
+        frame['Serving_Cell'] = np.asarray(columns['serving_cell'], dtype=np.int16)
+        frame['SINR_dB'] = np.asarray(columns['sinr_dB'], dtype=np.float64)
+    return frame
+
+def save_results(results, output_path):
+    """
+    Write ray tracing results, choosing the format from the file extension.
+    results is a list of result dicts or a typed table from results_to_frame/generate_scenario.
+    .parquet and .feather produce typed columnar files (requires pyarrow);
+    anything else is written as CSV.
+    """
+    file_format = COLUMNAR_FORMATS.get(os.path.splitext(output_path)[1].lower())
+    if file_format is None:
+        if isinstance(results, pd.DataFrame):
+            # Same text layout (and csv-module line endings) as save_results_to_csv
+            results.astype({'LOS': np.int8}).to_csv(output_path, index=False, float_format='%.2f',
+                                                    lineterminator='\r\n')
+        else:
+            save_results_to_csv(results, output_path)
+        return
+    
+    frame = results if isinstance(results, pd.DataFrame) else results_to_frame(results)
+    if file_format == 'parquet':
+        frame.to_parquet(output_path, index=False)
+    else:
+        frame.to_feather(output_path)
+
+def load_results(output_path):
+    """Read results written by save_results back as the typed table of results_to_frame."""
+    file_format = COLUMNAR_FORMATS.get(os.path.splitext(output_path)[1].lower())
+    if file_format == 'parquet':
+        return pd.read_parquet(output_path)
+    if file_format == 'feather':
+        return pd.read_feather(output_path)
+    
+    frame = pd.read_csv(output_path, keep_default_na=False, dtype={
+        'RX_ID': np.int32, 'CQI': np.int8, 'User_Request': 'category', 'Request_Label': 'category'
+    })
+    frame['LOS'] = frame['LOS'].astype(bool)
+    if 'Serving_Cell' in frame:
+        frame['Serving_Cell'] = frame['Serving_Cell'].astype(np.int16)
+    return frame
+
+def generate_scenario(tx_position, buildings, bounds, num_users, seed=0, request_mix=None, min_distance=0.0,
+                      tx_power_dBm=30, index=None, engine='simple'):
+    """
+    Deterministic synthetic user population as a typed table (see results_to_frame).
+    Positions, propagation and requests are drawn in one vectorized pass from
+    independent streams of the same seed, so a (seed, num_users, request_mix)
+    triple always yields the same table.
+    request_mix maps a slice label to its share of users (e.g. {'eMBB': 0.7, 'URLLC': 0.3});
+    requests are uniform within a label. By default every entry of USER_REQUESTS
+    is equally likely, as in generate_user_request.
+    """
+    position_seed, request_seed = np.random.SeedSequence(seed).spawn(2)
+    index = index if index is not None else build_spatial_index(buildings)
+    
+    rx_positions = generate_rx_positions(bounds, num_users, buildings, min_distance=min_distance,
+                                         index=index, seed=position_seed)
+    columns = _trace_receivers(tx_position, rx_positions, buildings, tx_power_dBm, index, engine)
+    
+    # Per-request probabilities from the label mix
+    requests = [request for request, _ in USER_REQUESTS]
+    labels = [label for _, label in USER_REQUESTS]
+    label_names = sorted(set(labels))
+    if request_mix is None:
+        probabilities = np.full(len(USER_REQUESTS), 1.0 / len(USER_REQUESTS))
+    else:
+        unknown = set(request_mix) - set(label_names)
+        if unknown:
+            raise ValueError(f"Unknown request labels in request_mix: {sorted(unknown)}")
+        total = float(sum(request_mix.values()))
+        per_label = {label: labels.count(label) for label in label_names}
+        probabilities = np.array([request_mix.get(label, 0.0) / total / per_label[label] for label in labels])
+    
+    rng = np.random.default_rng(request_seed)
+    request_codes = rng.choice(len(USER_REQUESTS), size=len(rx_positions), p=probabilities)
+    label_codes = np.array([label_names.index(label) for label in labels])[request_codes]
+    
+    return _results_frame(
+        rx_positions,
+        columns,
+        pd.Categorical.from_codes(request_codes, categories=requests),
+        pd.Categorical.from_codes(label_codes, categories=label_names)
+    )
+
+def run_parameter_sweep(tx_position, rx_positions, buildings, frequencies=(FREQUENCY_HZ,),
+                        bandwidths=(BANDWIDTH_HZ,), noise_figures=(NOISE_FIGURE_DB,), tx_powers=(30,),
+                        index=None, los=None, output_path=None):
+    """
+    Evaluate a grid of radio parameters against a single LOS computation.
+    LOS and TX-RX distances do not depend on the radio parameters, so they are computed
+    once per RX set (or passed in via los) and every combination of frequency, bandwidth,
+    noise figure and TX power is evaluated in one broadcast link-budget call.
+    Returns a dict of columns: per-scenario parameters of shape (P,), per-receiver
+    geometry of shape (N,) and results of shape (P, N). With output_path the columns
+    are written to a single .npz file.
+    """
+    rx_positions = np.asarray(rx_positions, dtype=float).reshape(-1, 3)
+    
+    # Geometry: computed once, shared by every scenario
+    if los is None:
+        los = has_line_of_sight_batch(tx_position, rx_positions, buildings, index=index)
+    distance = np.linalg.norm(rx_positions - np.asarray(tx_position, dtype=float), axis=1)
+    
+    # Full factorial grid of radio parameters, one row per scenario
+    grid = np.meshgrid(
+        np.asarray(frequencies, dtype=float),
+        np.asarray(bandwidths, dtype=float),
+        np.asarray(noise_figures, dtype=float),
+        np.asarray(tx_powers, dtype=float),
+        indexing='ij'
+    )
+    frequency, bandwidth, noise_figure, tx_power = (values.ravel() for values in grid)
+    
+    budget = calculate_link_budget(
+        distance[None, :], los[None, :],
+        tx_power[:, None], frequency[:, None], bandwidth[:, None], noise_figure[:, None]
+    )
+    
+    sweep = {
+        'Frequency_Hz': frequency,
+        'Bandwidth_Hz': bandwidth,
+        'Noise_Figure_dB': noise_figure,
+        'TX_Power_dBm': tx_power,
+        'RX_ID': np.arange(1, len(rx_positions) + 1, dtype=np.int32),
+        'X': rx_positions[:, 0],
+        'Y': rx_positions[:, 1],
+        'Z': rx_positions[:, 2],
+        'LOS': los.astype(np.int8),
+        'SNR_dB': budget['snr_dB'].astype(np.float32),
+        'RX_Power_dBm': budget['rx_power_dBm'].astype(np.float32),
+        'CQI': budget['cqi'].astype(np.int8)
+    }
+    
+    if output_path is not None:
+        np.savez(output_path, **sweep)
+        print(f"Sweep of {len(frequency)} scenarios x {len(rx_positions)} receivers saved to {output_path}")
+    
+    return sweep
+
+# Layers stored in a coverage map, with their on-disk dtypes
+COVERAGE_LAYERS = {
+    'snr_dB': np.float32,
+    'rx_power_dBm': np.float32,
+    'los': np.bool_,
+    'cqi': np.int8,
+    'indoor': np.bool_
+}
+
+def compute_coverage_map(tx_position, buildings, bounds, resolution=5.0, rx_height=1.5,
+                         tx_power_dBm=30, index=None, output_dir=None):
+    """
+    Evaluate SNR, RX power, LOS and CQI on a regular grid over the map bounds.
+    Layers are (ny, nx) arrays indexed [row=y, col=x]. With output_dir they are
+    written as memory-mapped .npy files that load_coverage_map can reopen later.
+    """
+    min_x, max_x, min_y, max_y = bounds
+    nx = int(math.floor((max_x - min_x) / resolution)) + 1
+    ny = int(math.floor((max_y - min_y) / resolution)) + 1
+    xs = min_x + np.arange(nx) * resolution
+    ys = min_y + np.arange(ny) * resolution
+    
+    grid_x, grid_y = np.meshgrid(xs, ys)
+    points = np.column_stack([grid_x.ravel(), grid_y.ravel(), np.full(grid_x.size, rx_height)])
+    
+    if index is None:
+        index = build_spatial_index(buildings)
+    
+    # LOS for every grid cell in one batched pass
+    los = has_line_of_sight_batch(tx_position, points, buildings, index=index)
+    
+    # Same link budget as per-receiver tracing, evaluated over the whole grid
+    distance = np.linalg.norm(points - np.asarray(tx_position, dtype=float), axis=1)
+    budget = calculate_link_budget(distance, los, tx_power_dBm)
+    
+    values = {
+        'snr_dB': budget['snr_dB'],
+        'rx_power_dBm': budget['rx_power_dBm'],
+        'los': los,
+        'cqi': budget['cqi'],
+        'indoor': points_in_buildings(points[:, 0], points[:, 1], buildings, index)
+    }
+    
+    coverage = {
+        'origin': (float(min_x), float(min_y)),
+        'resolution': float(resolution),
+        'shape': (ny, nx),
+        'rx_height': float(rx_height),
+        'tx_position': tuple(float(v) for v in tx_position)
+    }
+    
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    
+    for name, dtype in COVERAGE_LAYERS.items():
+        if output_dir is not None:
+            layer = np.lib.format.open_memmap(
+                os.path.join(output_dir, f"{name}.npy"), mode='w+', dtype=dtype, shape=(ny, nx)
+            )
+            layer[:] = values[name].reshape(ny, nx)
+            layer.flush()
+        else:
+            layer = values[name].reshape(ny, nx).astype(dtype)
+        coverage[name] = layer
+    
+    if output_dir is not None:
+        meta = {key: coverage[key] for key in ('origin', 'resolution', 'shape', 'rx_height', 'tx_position')}
+        with open(os.path.join(output_dir, 'coverage.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+    
+    return coverage
+
+def load_coverage_map(output_dir, mmap=True):
+    """Reopen a coverage map written by compute_coverage_map (memory-mapped by default)."""
+    with open(os.path.join(output_dir, 'coverage.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    
+    coverage = {
+        'origin': tuple(meta['origin']),
+        'resolution': meta['resolution'],
+        'shape': tuple(meta['shape']),
+        'rx_height': meta['rx_height'],
+        'tx_position': tuple(meta['tx_position'])
+    }
+    for name in COVERAGE_LAYERS:
+        coverage[name] = np.load(os.path.join(output_dir, f"{name}.npy"), mmap_mode='r' if mmap else None)
+    
+    return coverage
+
+def lookup_coverage(coverage, positions, layer='snr_dB', method='nearest'):
+    """
+    Read a coverage layer at arbitrary (x, y) positions in O(1) per position.
+    method is 'nearest' or 'bilinear'; positions outside the grid are clamped to its edge.
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, np.shape(positions)[-1])
+    ny, nx = coverage['shape']
+    x0, y0 = coverage['origin']
+    resolution = coverage['resolution']
+    values = coverage[layer]
+    
+    # Fractional grid coordinates
+    col = np.clip((positions[:, 0] - x0) / resolution, 0, nx - 1)
+    row = np.clip((positions[:, 1] - y0) / resolution, 0, ny - 1)
+    
+    if method == 'nearest':
+        return values[np.rint(row).astype(np.int64), np.rint(col).astype(np.int64)]
+    if method != 'bilinear':
+        raise ValueError(f"Unknown interpolation method: {method}")
+    
+    col0 = np.minimum(np.floor(col).astype(np.int64), max(nx - 2, 0))
+    row0 = np.minimum(np.floor(row).astype(np.int64), max(ny - 2, 0))
+    col1 = np.minimum(col0 + 1, nx - 1)
+    row1 = np.minimum(row0 + 1, ny - 1)
+    fx = col - col0
+    fy = row - row0
+    
+    # Gather only the four neighbour cells, so a memory-mapped layer is never read in full
+    top = values[row0, col0].astype(float) * (1 - fx) + values[row0, col1].astype(float) * fx
+    bottom = values[row1, col0].astype(float) * (1 - fx) + values[row1, col1].astype(float) * fx
+    return top * (1 - fy) + bottom * fy
+
+def lookup_cqi(coverage, positions, method='nearest'):
+    """
+    Look up user CQI from a coverage map instead of re-tracing.
+    Nearest reads the CQI layer directly; bilinear interpolates SNR and maps it to CQI.
+    """
+    if method == 'nearest':
+        return lookup_coverage(coverage, positions, 'cqi', 'nearest').astype(int)
+    snr_dB = lookup_coverage(coverage, positions, 'snr_dB', method)
+    return calculate_cqi_array(snr_dB)
+
+def _outdoor_points(rng, bounds, count, buildings, index=None):
+    """Uniform random (x, y) points within bounds that fall outside every building footprint."""
+    min_x, max_x, min_y, max_y = bounds
+    parts = []
+    found = 0
+    while found < count:
+        x = rng.uniform(min_x, max_x, 2 * count)
+        y = rng.uniform(min_y, max_y, 2 * count)
+        outside = ~points_in_buildings(x, y, buildings, index)
+        parts.append(np.column_stack([x[outside], y[outside]]))
+        found += int(outside.sum())
+    return np.concatenate(parts)[:count]
+
+def iter_mobility_trace(tx_position, buildings, bounds, num_users, num_steps, dt=1.0, speed_range=(0.5, 1.5),
+                        max_pause_steps=5, static_fraction=0.0, tx_power_dBm=30, index=None, seed=None,
+                        engine='simple'):
+    """
+    Random-waypoint mobility over the ray tracing scene, yielding one dict per time step.
+    Users walk at a random speed towards an outdoor waypoint. Each user pauses there for
+    up to max_pause_steps before picking the next one; a step that would enter a building
+    makes the user pick a new waypoint instead. A static_fraction of the users never
+    moves (seated or indoor-like users). Only users that moved are re-traced, and
+    the LOS and link budget of everyone else are reused from the previous step.
+    Each step carries 'step', 'time', 'positions', 'moved', 'has_los', 'snr_dB' and 'cqi'.
+    """
+    # Independent streams for the start positions and the walk, so waypoints never replay the
+    # draws that placed the users
+    position_seed, walk_seed = np.random.SeedSequence(seed).spawn(2)
+    rng = np.random.default_rng(walk_seed)
+    index = index if index is not None else build_spatial_index(buildings)
+    
+    positions = generate_rx_positions(bounds, num_users, buildings, index=index, seed=position_seed)
+    num_users = len(positions)
+    waypoints = _outdoor_points(rng, bounds, num_users, buildings, index)
+    speeds = rng.uniform(speed_range[0], speed_range[1], num_users)
+    pause = np.zeros(num_users, dtype=np.int64)
+    static = rng.random(num_users) < static_fraction
+    
+    # Step 0 traces everybody
+    columns = _trace_receivers(tx_position, positions, buildings, tx_power_dBm, index, engine)
+    has_los = columns['has_los'].copy()
+    snr_dB = np.asarray(columns['snr_dB'], dtype=float).copy()
+    cqi = np.asarray(columns['cqi']).copy()
+    moved = np.ones(num_users, dtype=bool)
+    
+    for step in range(num_steps + 1):
+        if step > 0:
+            # Advance users that are not pausing, stopping at the waypoint
+            offset = waypoints - positions[:, :2]
+            remaining = np.hypot(offset[:, 0], offset[:, 1])
+            walking = ~static & (pause == 0) & (remaining > 0)
+            advance = np.minimum(speeds * dt, remaining)
+            scale = np.where(walking, advance / np.maximum(remaining, 1e-12), 0.0)
+            candidate = positions[:, :2] + offset * scale[:, None]
             
-            writer.writeheader()
-            for i, result in enumerate(results):
-                pos = result['position']
-                writer.writerow({
-                    'RX_ID': i+1,
-                    'X': f"{pos[0]:.2f}",
-                    'Y': f"{pos[1]:.2f}",
-                    'Z': f"{pos[2]:.2f}",
-                    'SNR_dB': f"{result['snr_dB']:.2f}",
-                    'RX_Power_dBm': f"{result['rx_power_dBm']:.2f}",
-                    'CQI': result['cqi'],
-                    'LOS': 1 if result['has_los'] else 0,
-                    'User_Request': result['user_request'],
-                    'Request_Label': result['request_label']
-                })
-        print(f"Results saved to {output_path}")
-        
-        # Visualize results with SNR
-        plt.figure(figsize=(18, 13))
-        
-        # Plot buildings
-        for building in cartesian_buildings:
-            nodes = building['nodes']
-            x = [node[0] for node in nodes]
-            y = [node[1] for node in nodes]
-            plt.fill(x, y, alpha=0.3, color='gray', edgecolor='black')
-        
-        # Plot TX position
-        plt.scatter(tx_position[0], tx_position[1], color='red', s=200, marker='^', label='BS')
-        
-        # Plot RX positions with color based on SNR
-        los_rx = [result for result in results if result['has_los']]
-        nlos_rx = [result for result in results if not result['has_los']]
-        
-        if los_rx:
-            los_x = [result['position'][0] for result in los_rx]
-            los_y = [result['position'][1] for result in los_rx]
-            los_snr = [result['snr_dB'] for result in los_rx]
-            sc_los = plt.scatter(los_x, los_y, c=los_snr, cmap='viridis', s=100, marker='x', label='LOS User')
-        
-        if nlos_rx:
-            nlos_x = [result['position'][0] for result in nlos_rx]
-            nlos_y = [result['position'][1] for result in nlos_rx]
-            nlos_snr = [result['snr_dB'] for result in nlos_rx]
-            sc_nlos = plt.scatter(nlos_x, nlos_y, c=nlos_snr, cmap='viridis', s=100, marker='o', label='NLOS User')
+            # Steps into a building are refused and the user re-routes
+            blocked = walking & points_in_buildings(candidate[:, 0], candidate[:, 1], buildings, index)
+            moved = walking & ~blocked
+            positions[moved, :2] = candidate[moved]
+            
+            # Users at their waypoint start a pause, then draw the next waypoint. Arrivals snap
+            # onto the waypoint so rounding never leaves them a hair short of it
+            arrived = moved & (advance >= remaining)
+            positions[arrived, :2] = waypoints[arrived]
+            pause[pause > 0] -= 1
+            pause[arrived] = rng.integers(0, max_pause_steps + 1, int(arrived.sum()))
+            renew = blocked | (arrived & (pause == 0)) | ((pause == 0) & (remaining == 0))
+            if renew.any():
+                waypoints[renew] = _outdoor_points(rng, bounds, int(renew.sum()), buildings, index)
+            
+            # Re-trace only the users that moved
+            if moved.any():
+                columns = _trace_receivers(tx_position, positions[moved], buildings, tx_power_dBm, index, engine)
+                has_los[moved] = columns['has_los']
+                snr_dB[moved] = columns['snr_dB']
+                cqi[moved] = columns['cqi']
         
-        # Create colorbar for SNR values
-        snr_values = [result['snr_dB'] for result in results]
-        if snr_values:
-            cbar = plt.colorbar()
+        yield {
+            'step': step,
+            'time': step * dt,
+            'positions': positions.copy(),
+            'moved': moved.copy(),
+            'has_los': has_los.copy(),
+            'snr_dB': snr_dB.copy(),
+            'cqi': cqi.copy()
+        }
+
+def save_mobility_trace(trace, output_path):
+    """
+    Stream per-step mobility results to CSV as they are produced, one row per user per step.
+    Returns the number of steps written.
+    """
+    num_steps = 0
+    with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['Step', 'Time_s', 'RX_ID', 'X', 'Y', 'Z', 'SNR_dB', 'CQI', 'LOS', 'Moved'])
         
-        cbar.set_label('SNR (dB)', fontsize=24)  # 设置标题字体
-        cbar.ax.tick_params(labelsize=24)        # 设置刻度标签字体
-        plt.xlabel('X (m)', fontsize=24)
-        plt.ylabel('Y (m)', fontsize=24)
-        #plt.title('Ray Tracing Results - OpenStreetMap', fontsize=12)
-        plt.legend(fontsize=24)
-        plt.axis('equal')
-        plt.grid(True, linestyle='--', alpha=0.7)
-        plt.savefig('ray_tracing_map_center.png', dpi=300)
-        plt.show()
+        for frame in trace:
+            positions = frame['positions']
+            writer.writerows(
+                (frame['step'], f"{frame['time']:.2f}", i + 1,
+                 f"{positions[i, 0]:.2f}", f"{positions[i, 1]:.2f}", f"{positions[i, 2]:.2f}",
+                 f"{frame['snr_dB'][i]:.2f}", int(frame['cqi'][i]), int(frame['has_los'][i]), int(frame['moved'][i]))
+                for i in range(len(positions))
+            )
+            num_steps += 1
+    return num_steps
 
+def _building_collection(buildings):
+    """All building footprints as a single PolyCollection."""
+    return PolyCollection(
+        [np.asarray(building['polygon'].exterior.coords)[:, :2] for building in buildings],
+        facecolors='gray', edgecolors='black', alpha=0.3
+    )
 
+def _thin(indices, max_points):
+    """Evenly subsample an index array down to at most max_points entries."""
+    if max_points is None or len(indices) <= max_points:
+        return indices
+    return indices[np.linspace(0, len(indices) - 1, max_points).astype(np.int64)]
 
-        # Create CQI visualization
-        plt.figure(figsize=(15, 12))
-        
-        # Plot buildings again for CQI visualization
-        for building in cartesian_buildings:
-            nodes = building['nodes']
-            x = [node[0] for node in nodes]
-            y = [node[1] for node in nodes]
-            plt.fill(x, y, alpha=0.3, color='gray', edgecolor='black')
-        
-        # Plot TX position
-        plt.scatter(tx_position[0], tx_position[1], color='red', s=150, marker='p', label='BS')
-        
-        # Plot RX positions with color based on CQI
-        rx_x = [result['position'][0] for result in results]
-        rx_y = [result['position'][1] for result in results]
-        cqi_values = [result['cqi'] for result in results]
+def render_results(tx_position, results, buildings, snr_map_path='ray_tracing_map_center.png',
+                   cqi_map_path='cqi_distribution_map.png', dpi=300, max_points=20000):
+    """
+    Render the SNR and CQI maps to image files with the Agg backend.
+    results is a list of result dicts or a typed table from results_to_frame/load_results.
+    Buildings are drawn as one PolyCollection and receivers as one scatter per class;
+    beyond max_points receivers the scatters are evenly subsampled.
+    tx_position may be a single TX or a list of TX positions.
+    """
+    tx_positions = np.asarray(tx_position, dtype=float).reshape(-1, 3)
+    if isinstance(results, pd.DataFrame):
+        positions = results[['X', 'Y', 'Z']].to_numpy(dtype=float)
+        snr = results['SNR_dB'].to_numpy(dtype=float)
+        cqi = results['CQI'].to_numpy(dtype=int)
+        has_los = results['LOS'].to_numpy(dtype=bool)
+    else:
+        positions = np.array([result['position'] for result in results], dtype=float).reshape(-1, 3)
+        snr = np.array([result['snr_dB'] for result in results], dtype=float)
+        cqi = np.array([result['cqi'] for result in results], dtype=int)
+        has_los = np.array([result['has_los'] for result in results], dtype=bool)
+    
+    # Visualize results with SNR
+    fig = Figure(figsize=(18, 13))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.add_collection(_building_collection(buildings))
+    
+    # Plot TX position
+    ax.scatter(tx_positions[:, 0], tx_positions[:, 1], color='red', s=200, marker='^', label='BS')
+    
+    # Plot RX positions with color based on SNR, one scatter per class on a shared scale
+    vmin, vmax = (snr.min(), snr.max()) if len(snr) else (None, None)
+    sc = None
+    for mask, marker, label in ((has_los, 'x', 'LOS User'), (~has_los, 'o', 'NLOS User')):
+        idx = _thin(np.nonzero(mask)[0], max_points)
+        if len(idx):
+            sc = ax.scatter(positions[idx, 0], positions[idx, 1], c=snr[idx], cmap='viridis',
+                            vmin=vmin, vmax=vmax, s=100, marker=marker, label=label)
+    
+    # Create colorbar for SNR values
+    if sc is not None:
+        cbar = fig.colorbar(sc, ax=ax)
+        cbar.set_label('SNR (dB)', fontsize=24)
+        cbar.ax.tick_params(labelsize=24)
+    ax.set_xlabel('X (m)', fontsize=24)
+    ax.set_ylabel('Y (m)', fontsize=24)
+    ax.legend(fontsize=24)
+    ax.axis('equal')
+    ax.autoscale_view()
+    ax.grid(True, linestyle='--', alpha=0.7)
+    fig.savefig(snr_map_path, dpi=dpi)
+    
+    # Create CQI visualization
+    fig = Figure(figsize=(15, 12))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.add_collection(_building_collection(buildings))
+    ax.scatter(tx_positions[:, 0], tx_positions[:, 1], color='red', s=150, marker='p', label='BS')
+    
+    # Plot RX positions with color based on CQI
+    idx = _thin(np.arange(len(results)), max_points)
+    sc = ax.scatter(positions[idx, 0], positions[idx, 1], c=cqi[idx], cmap='viridis', vmin=1, vmax=15, s=30)
+    
+    # Create colorbar for CQI values
+    cbar = fig.colorbar(sc, ax=ax, label='CQI (1-15)')
+    cbar.set_ticks(range(1, 16))
+    
+    ax.set_xlabel('X (m)', fontsize=12)
+    ax.set_ylabel('Y (m)', fontsize=12)
+    ax.set_title('Channel Quality Indicator (CQI) Distribution')
+    ax.axis('equal')
+    ax.autoscale_view()
+    ax.grid(True, linestyle='--', alpha=0.7)
+    fig.savefig(cqi_map_path, dpi=dpi)
+
+def render_coverage_map(coverage, buildings, output_path, layer='cqi', max_pixels=2000, dpi=150):
+    """
+    Render one coverage-map layer as an image with the Agg backend.
+    Rasters larger than max_pixels along either axis are downsampled by striding.
+    """
+    ny, nx = coverage['shape']
+    stride = max(1, int(math.ceil(max(ny, nx) / max_pixels)))
+    values = np.asarray(coverage[layer][::stride, ::stride])
+    
+    x0, y0 = coverage['origin']
+    resolution = coverage['resolution']
+    extent = (x0 - resolution / 2, x0 + (nx - 0.5) * resolution,
+              y0 - resolution / 2, y0 + (ny - 0.5) * resolution)
+    
+    fig = Figure(figsize=(15, 12))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    limits = {'vmin': 1, 'vmax': 15} if layer == 'cqi' else {}
+    image = ax.imshow(values, origin='lower', extent=extent, cmap='viridis', interpolation='nearest', **limits)
+    ax.add_collection(_building_collection(buildings))
+    
+    tx = coverage['tx_position']
+    ax.scatter([tx[0]], [tx[1]], color='red', s=150, marker='p', label='BS')
+    fig.colorbar(image, ax=ax, label=layer)
+    ax.set_xlabel('X (m)', fontsize=12)
+    ax.set_ylabel('Y (m)', fontsize=12)
+    ax.set_aspect('equal')
+    ax.legend()
+    fig.savefig(output_path, dpi=dpi)
+
+# Defaults for the command line and JSON config files
+DEFAULT_CONFIG = {
+    'maps': [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Knowledge_Base', 'HKUST_F.osm')],
+    'num_rx': 30,  # Number of RX positions per map
+    'num_tx': 1,  # TXs on the tallest buildings; more than one adds best-server association and SINR
+    'seed': None,
+    'min_distance': 5.0,
+    'workers': 1,
+    'output_format': 'csv',
+    'output_dir': '.',
+    'render': True,
+    'engine': 'simple',
+    'tx_power_dBm': 30,
+    'cache_dir': None,
+    'incremental': False,
+    'profile': False,
+    'cprofile': False
+}
+
+def load_config(config_path=None, overrides=None):
+    """
+    Build a run configuration: DEFAULT_CONFIG, then the JSON file at config_path, then overrides.
+    Relative paths in the file (maps, output_dir, cache_dir) are resolved against the file's directory.
+    """
+    config = dict(DEFAULT_CONFIG)
+    if config_path is not None:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            file_config = json.load(f)
+        unknown = set(file_config) - set(DEFAULT_CONFIG)
+        if unknown:
+            raise ValueError(f"Unknown keys in {config_path}: {sorted(unknown)}")
+        base_dir = os.path.dirname(os.path.abspath(config_path))
+        if 'maps' in file_config:
+            file_config['maps'] = [os.path.join(base_dir, path) for path in file_config['maps']]
+        for key in ('output_dir', 'cache_dir'):
+            if file_config.get(key) is not None:
+                file_config[key] = os.path.join(base_dir, file_config[key])
+        config.update(file_config)
+    config.update(overrides or {})
+    
+    if config['output_format'] not in ('csv', 'parquet', 'feather'):
+        raise ValueError(f"Unsupported output format: {config['output_format']}")
+    if config['engine'] not in PROPAGATION_ENGINES:
+        raise ValueError(f"Unknown propagation engine: {config['engine']}")
+    if config['num_tx'] < 1:
+        raise ValueError(f"num_tx must be at least 1, got {config['num_tx']}")
+    if config['num_tx'] > 1 and config['engine'] != 'simple':
+        raise ValueError("Multi-TX runs only support the 'simple' propagation engine")
+    if config['num_tx'] > 1 and config['incremental']:
+        raise ValueError("Incremental runs only support a single TX")
+    return config
+
+def parse_args(argv=None):
+    """Command-line options; anything left unset falls back to the config file and DEFAULT_CONFIG."""
+    parser = argparse.ArgumentParser(description='Ray tracing and CQI generation over OSM building maps.')
+    parser.add_argument('--config', help='JSON config file with any of the DEFAULT_CONFIG keys')
+    parser.add_argument('--map', dest='maps', action='append', help='OSM map file; repeat to run a batch')
+    parser.add_argument('--num-rx', type=int, help='number of receivers per map')
+    parser.add_argument('--num-tx', type=int,
+                        help='TXs on the tallest buildings; above 1 adds Serving_Cell and SINR_dB (serial tracing)')
+    parser.add_argument('--seed', type=int, help='seed for receiver placement and user requests')
+    parser.add_argument('--min-distance', type=float, help='minimum distance between receivers (m)')
+    parser.add_argument('--workers', type=int, help='tracing processes, shared by all maps')
+    parser.add_argument('--format', dest='output_format', choices=['csv', 'parquet', 'feather'])
+    parser.add_argument('--output-dir', help='directory for results, maps and reports')
+    parser.add_argument('--engine', choices=sorted(PROPAGATION_ENGINES), help='propagation engine')
+    parser.add_argument('--tx-power', dest='tx_power_dBm', type=float, help='TX power (dBm)')
+    parser.add_argument('--cache-dir', help='geometry cache directory')
+    parser.add_argument('--incremental', action=argparse.BooleanOptionalAction, default=None,
+                        help='after a map edit, re-trace only the affected rows of the saved results')
+    parser.add_argument('--render', action=argparse.BooleanOptionalAction, default=None,
+                        help='write the SNR and CQI map images')
+    parser.add_argument('--profile', action=argparse.BooleanOptionalAction, default=None,
+                        help='write a per-stage profiling report next to the results')
+    parser.add_argument('--cprofile', action=argparse.BooleanOptionalAction, default=None,
+                        help='also dump cProfile stats next to the results')
+    return parser.parse_args(argv)
+
+# Settings that must match for --incremental to reuse saved results
+INCREMENTAL_KEYS = ('num_rx', 'seed', 'min_distance', 'engine', 'tx_power_dBm')
+
+def _save_map_state(output_path, digest, buildings, ref_point, tx_position, rx_positions, config):
+    """
+    Record what saved results were traced against, for later incremental runs:
+    the buildings (in the results' frame) and exact RX positions in <output>.map.npz,
+    and the map hash, TX and tracing settings in <output>.map.json.
+    """
+    base = os.path.splitext(output_path)[0]
+    save_geometry_cache(f"{base}.map.npz", buildings, ref_point,
+                        rx_positions=np.asarray(rx_positions, dtype=float).reshape(-1, 3))
+    state = {'map_digest': digest, 'tx_position': [float(v) for v in tx_position]}
+    state.update({key: config[key] for key in INCREMENTAL_KEYS})
+    with open(f"{base}.map.json", 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+
+def _update_saved_results(file_path, config, output_path, digest, profile=None):
+    """
+    Bring the results an earlier run saved at output_path up to date with the current map:
+    only receivers affected by the edit are re-traced, and the rest of the table is kept.
+    Returns (results table, tx_position, rx_positions, buildings, ref_point), or None when a
+    full run is needed (no saved state, different settings, or the TX moved to another building).
+    """
+    base = os.path.splitext(output_path)[0]
+    state_path = f"{base}.map.json"
+    if not all(os.path.exists(path) for path in (output_path, state_path, f"{base}.map.npz")):
+        print("No saved results to update; tracing all receivers")
+        return None
+    with open(state_path, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    if any(state.get(key) != config[key] for key in INCREMENTAL_KEYS):
+        print("Tracing settings changed since the saved results; tracing all receivers")
+        return None
+    
+    # The previous buildings fix the frame; the current map is projected into it
+    old_buildings, _, ref_point = load_geometry_cache(f"{base}.map.npz")
+    with np.load(f"{base}.map.npz") as data:
+        rx_positions = data['rx_positions']
+    if digest == state['map_digest']:
+        new_buildings = old_buildings
+    else:
+        new_buildings, _, _ = load_buildings(file_path, config['cache_dir'], ref_point=ref_point, profile=profile)
+    if not new_buildings:
+        return None
+    
+    tx_position = place_tx(find_tallest_building(new_buildings))
+    if not np.allclose(tx_position, state['tx_position'], rtol=0, atol=1e-6):
+        print("TX moved with the map edit; tracing all receivers")
+        return None
+    
+    with profile_stage(profile, 'results_read'):
+        results = load_results(output_path)
+    if len(results) != len(rx_positions):
+        print("Saved results do not match the saved receivers; tracing all receivers")
+        return None
+    with profile_stage(profile, 'retrace') as stage:
+        index = build_spatial_index(new_buildings)
+        affected = retrace_changed_buildings(tx_position, rx_positions, results, old_buildings, new_buildings,
+                                             index=index, tx_power_dBm=config['tx_power_dBm'],
+                                             engine=config['engine'])
+        stage['receivers'] = len(affected)
+    print(f"Map {'changed' if digest != state['map_digest'] else 'unchanged'}: "
+          f"re-traced {len(affected)} of {len(results)} receivers")
+    return results, tx_position, rx_positions, new_buildings, ref_point
+
+def run_map(file_path, config, executor=None, suffix=''):
+    """
+    Trace one map with the settings in config and write its outputs to config['output_dir'].
+    suffix is appended to every output file name. executor is a shared process pool used
+    when config['workers'] > 1. With config['incremental'] the results saved by an earlier
+    incremental run are updated in place after a map edit (see _update_saved_results).
+    Returns the results (a typed table after an incremental update), or None if the map
+    has no buildings.
+    """
+    os.makedirs(config['output_dir'], exist_ok=True)
+    output_base = os.path.join(config['output_dir'], f"ray_tracing_results{suffix}")
+    output_path = f"{output_base}.{config['output_format']}"
+    
+    # Per-stage timings/memory go to <output>.profile.json, cProfile stats to <output>.prof
+    profile = start_profile() if config['profile'] else None
+    profiler = cProfile.Profile() if config['cprofile'] else None
+    if profiler is not None:
+        profiler.enable()
+    
+    try:
+        digest = _file_digest(file_path) if config['incremental'] else None
+        updated = (_update_saved_results(file_path, config, output_path, digest, profile)
+                   if config['incremental'] else None)
+        if updated is not None:
+            results, tx_position, rx_positions, cartesian_buildings, ref_point = updated
+        else:
+            # Parse buildings from OSM and convert to Cartesian coordinates (cached on disk)
+            cartesian_buildings, transformer, ref_point = load_buildings(
+                file_path, config['cache_dir'], profile=profile
+            )
+            print(f"Found {len(cartesian_buildings)} buildings in OSM file")
+            
+            if not cartesian_buildings:
+                print("No buildings found in the OSM file. Please check the file content.")
+                return None
+            
+            # Build the spatial index once for LOS queries and RX placement
+            with profile_stage(profile, 'spatial_index'):
+                spatial_index = build_spatial_index(cartesian_buildings)
+            
+            # Find tallest building
+            tallest_building = find_tallest_building(cartesian_buildings)
+            print(f"Tallest building height: {tallest_building['height']} meters")
+            
+            # Place TX at tallest building, or one TX on each of the num_tx tallest
+            if config['num_tx'] > 1:
+                tx_position = [place_tx(building)
+                               for building in find_tallest_buildings(cartesian_buildings, config['num_tx'])]
+                for k, position in enumerate(tx_position):
+                    print(f"TX {k+1} position: ({position[0]:.2f}, {position[1]:.2f}, {position[2]:.2f}) m")
+            else:
+                tx_position = place_tx(tallest_building)
+                print(f"TX position: ({tx_position[0]:.2f}, {tx_position[1]:.2f}, {tx_position[2]:.2f}) m")
+            
+            # Calculate scene bounds
+            all_nodes = [node for building in cartesian_buildings for node in building['nodes']]
+            min_x = min(node[0] for node in all_nodes)
+            max_x = max(node[0] for node in all_nodes)
+            min_y = min(node[1] for node in all_nodes)
+            max_y = max(node[1] for node in all_nodes)
+            
+            # Add some buffer to bounds
+            buffer = max((max_x - min_x), (max_y - min_y)) * 0.1
+            bounds = (min_x - buffer, max_x + buffer, min_y - buffer, max_y + buffer)
+            
+            # Generate random RX positions
+            with profile_stage(profile, 'rx_generation') as stage:
+                rx_positions = generate_rx_positions(bounds, config['num_rx'], cartesian_buildings,
+                                                     min_distance=config['min_distance'], index=spatial_index,
+                                                     seed=config['seed'], stats=stage)
+            
+            # Seed the user-request draw as well, so seeded runs are fully reproducible
+            if config['seed'] is not None:
+                random.seed(config['seed'])
+            
+            # Perform ray tracing
+            if config['num_tx'] > 1:
+                with profile_stage(profile, 'tracing') as stage:
+                    results = perform_multi_tx_ray_tracing(tx_position, rx_positions, cartesian_buildings,
+                                                           config['tx_power_dBm'], index=spatial_index)
+                    stage['transmitters'] = len(tx_position)
+            elif config['workers'] > 1:
+                with profile_stage(profile, 'tracing') as stage:
+                    results = perform_ray_tracing_parallel(
+                        tx_position, rx_positions, cartesian_buildings, config['tx_power_dBm'], config['workers'],
+                        executor=executor, engine=config['engine'], map_file=file_path,
+                        cache_dir=config['cache_dir']
+                    )
+                    stage['workers'] = config['workers']
+            else:
+                results = perform_ray_tracing(tx_position, rx_positions, cartesian_buildings,
+                                              config['tx_power_dBm'], index=spatial_index,
+                                              engine=config['engine'], profile=profile)
         
-        sc = plt.scatter(rx_x, rx_y, c=cqi_values, cmap='viridis', vmin=1, vmax=15, s=30)
+        # Save results
+        with profile_stage(profile, 'results_write') as stage:
+            save_results(results, output_path)
+            if config['incremental']:
+                _save_map_state(output_path, digest, cartesian_buildings, ref_point, tx_position, rx_positions,
+                                config)
+            stage['format'] = config['output_format']
+        print(f"Results saved to {output_path}")
         
-        # Create colorbar for CQI values
-        cbar = plt.colorbar(sc, label='CQI (1-15)')
-        cbar.set_ticks(range(1, 16))
+        # Render maps only when requested (headless, never blocks). A single map keeps the
+        # original image names; in a batch every image carries the map suffix
+        if config['render']:
+            if suffix:
+                snr_map_name, cqi_map_name = f"ray_tracing_map{suffix}.png", f"cqi_distribution_map{suffix}.png"
+            else:
+                snr_map_name, cqi_map_name = 'ray_tracing_map_center.png', 'cqi_distribution_map.png'
+            with profile_stage(profile, 'plotting'):
+                render_results(
+                    tx_position, results, cartesian_buildings,
+                    snr_map_path=os.path.join(config['output_dir'], snr_map_name),
+                    cqi_map_path=os.path.join(config['output_dir'], cqi_map_name)
+                )
         
-        plt.xlabel('X (m)', fontsize=12)
-        plt.ylabel('Y (m)', fontsize=12)
-        plt.title('Channel Quality Indicator (CQI) Distribution')
-        plt.axis('equal')
-        plt.grid(True, linestyle='--', alpha=0.7)
-        plt.savefig('cqi_distribution_map.png', dpi=300)
+        if profile is not None:
+            report_path = f"{output_base}.profile.json"
+            write_profile_report(profile, report_path, map=os.path.basename(file_path),
+                                 buildings=len(cartesian_buildings), receivers=len(results),
+                                 workers=config['workers'], engine=config['engine'])
+            print(f"Profiling report saved to {report_path}")
         
-        # Output example results
-        print("\nRX Positions, SNR, CQI, and User Requests (first 10 shown):")
-        for i, result in enumerate(results[:10]):
-            pos = result['position']
-            snr = result['snr_dB']
-            cqi = result['cqi']
-            los = "LOS" if result['has_los'] else "NLOS"
-            request = result['user_request']
-            label = result['request_label']
-            
-            print(f"RX {i+1}: Position ({pos[0]:.2f}, {pos[1]:.2f}, {pos[2]:.2f}) m")
-            print(f"    SNR: {snr:.2f} dB, CQI: {cqi}, {los}")
-            print(f"    Request: \"{request}\" (Label: {label})")
-            print("---")
+        if isinstance(results, pd.DataFrame):
+            cqi_values = results['CQI'].tolist()
+        else:
+            # Output example results
+            print("\nRX Positions, SNR, CQI, and User Requests (first 10 shown):")
+            for i, result in enumerate(results[:10]):
+                pos = result['position']
+                snr = result['snr_dB']
+                cqi = result['cqi']
+                los = "LOS" if result['has_los'] else "NLOS"
+                request = result['user_request']
+                label = result['request_label']
+                
+                print(f"RX {i+1}: Position ({pos[0]:.2f}, {pos[1]:.2f}, {pos[2]:.2f}) m")
+                print(f"    SNR: {snr:.2f} dB, CQI: {cqi}, {los}")
+                if 'serving_cell' in result:
+                    print(f"    Serving cell: TX {result['serving_cell']}, SINR: {result['sinr_dB']:.2f} dB")
+                print(f"    Request: \"{request}\" (Label: {label})")
+                print("---")
+            cqi_values = [r['cqi'] for r in results]
         
         # Generate CQI statistics
         cqi_counts = {}
         for i in range(1, 16):
-            cqi_counts[i] = len([r for r in results if r['cqi'] == i])
+            cqi_counts[i] = cqi_values.count(i)
             
         print("\nCQI Distribution:")
         for cqi, count in cqi_counts.items():
             print(f"CQI {cqi}: {count} receivers ({count/len(results)*100:.1f}%)")
+        
+        return results
     
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
-        import traceback
-        traceback.print_exc()
+    finally:
+        stop_profile(profile)
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(f"{output_base}.prof")
+
+def _batch_suffixes(maps):
+    """
+    Output file suffix for each map of a batch: the map name without the prefix shared by
+    all maps, lowercased, e.g. HKUST_North.osm -> _north as in ray_tracing_results_north.csv.
+    A single map gets no suffix, so it keeps the original output names.
+    """
+    names = [os.path.splitext(os.path.basename(file_path))[0] for file_path in maps]
+    if len(names) < 2:
+        return [''] * len(names)
+    
+    # Strip whole '_'-separated words only (HKUST_North/HKUST_Nova keep north/nova)
+    prefix = os.path.commonprefix(names)
+    prefix = prefix[:prefix.rfind('_') + 1]
+    return [f"_{name[len(prefix):].lower()}" for name in names]
+
+def run_batch(config):
+    """
+    Run every map in config['maps'] in one process. With several workers a single process
+    pool is started up front and shared by all maps. A failing map is reported and skipped.
+    Returns {map path: results or None}.
+    """
+    maps = config['maps']
+    executor = ProcessPoolExecutor(max_workers=config['workers']) if config['workers'] > 1 else None
+    outputs = {}
+    try:
+        for file_path, suffix in zip(maps, _batch_suffixes(maps)):
+            print(f"\n========== {file_path} ==========")
+            try:
+                outputs[file_path] = run_map(file_path, config, executor, suffix)
+            except Exception as e:
+                print(f"An error occurred: {str(e)}")
+                import traceback
+                traceback.print_exc()
+                outputs[file_path] = None
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return outputs
+
+def main(argv=None):
+    args = parse_args(argv)
+    overrides = {key: value for key, value in vars(args).items() if key != 'config' and value is not None}
+    config = load_config(args.config, overrides)
+    run_batch(config)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
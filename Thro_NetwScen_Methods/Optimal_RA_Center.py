@@ -1,5 +1,6 @@
 # 2025/3/25 add a csv file to store the optimal allocation results.
 import numpy as np
+import pandas as pd
 from scipy import optimize
 import math
 import csv
@@ -223,6 +224,32 @@ def solve_resource_allocation(B, M, Q, B_min, B_max, R_min, R_max, alpha):
         print("Using fallback bandwidth allocation method...")
         return fallback_allocation(B, M, Q, B_min, B_max, R_min, R_max, alpha)
 
+def read_user_rows(file_path, max_users):
+    """
+    Read (user_id, cqi, request_label) for the first max_users rows of a ray tracing
+    results file. Parquet and Feather files are read as typed columns; anything else is CSV.
+    """
+    if file_path.endswith(('.parquet', '.feather')):
+        columns = ['RX_ID', 'CQI', 'Request_Label']
+        if file_path.endswith('.parquet'):
+            df = pd.read_parquet(file_path, columns=columns)
+        else:
+            df = pd.read_feather(file_path, columns=columns)
+        df = df.head(max_users)
+        return list(zip(df['RX_ID'].astype(int).tolist(), df['CQI'].astype(int).tolist(),
+                        df['Request_Label'].astype(str).tolist()))
+    
+    rows = []
+    with open(file_path, 'r') as csv_file:
+        csvreader = csv.DictReader(csv_file)
+        
+        for i, row in enumerate(csvreader):
+            if i >= max_users:
+                break
+            
+            rows.append((int(row['RX_ID']), int(row['CQI']), row['Request_Label']))
+    return rows
+
 def process_embb_users(file_path, max_users=30):
     """
     Process eMBB users from the CSV file and perform bandwidth allocation.
@@ -246,19 +273,9 @@ def process_embb_users(file_path, max_users=30):
     embb_users = []
     
     try:
-        with open(file_path, 'r') as csv_file:
-            csvreader = csv.DictReader(csv_file)
-            
-            for i, row in enumerate(csvreader):
-                if i >= max_users:
-                    break
-                    
-                user_id = int(row['RX_ID'])
-                cqi = int(row['CQI'])
-                user_type = row['Request_Label']
-                
-                if user_type == 'eMBB':
-                    embb_users.append((user_id, cqi))
+        for user_id, cqi, user_type in read_user_rows(file_path, max_users):
+            if user_type == 'eMBB':
+                embb_users.append((user_id, cqi))
     
         print(f"Analyzed first {max_users} users from the CSV file")
         print(f"Found {len(embb_users)} eMBB users")
@@ -368,19 +385,9 @@ def process_urllc_users(file_path, max_users=30):
     urllc_users = []
     
     try:
-        with open(file_path, 'r') as csv_file:
-            csvreader = csv.DictReader(csv_file)
-            
-            for i, row in enumerate(csvreader):
-                if i >= max_users:
-                    break
-                    
-                user_id = int(row['RX_ID'])
-                cqi = int(row['CQI'])
-                user_type = row['Request_Label']
-                
-                if user_type == 'URLLC':
-                    urllc_users.append((user_id, cqi))
+        for user_id, cqi, user_type in read_user_rows(file_path, max_users):
+            if user_type == 'URLLC':
+                urllc_users.append((user_id, cqi))
     
         print(f"Analyzed first {max_users} users from the CSV file")
         print(f"Found {len(urllc_users)} URLLC users")
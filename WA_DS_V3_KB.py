@@ -10,15 +10,20 @@
 # 2025-03-27 10:25 add total transmission rate tracking and average resource utilization
 
 # Import necessary libraries
-from typing import Dict, List, Any, Optional, TypedDict
+from typing import Dict, List, Any, Literal, Optional, TypedDict
 import json
 import time
+import asyncio
 import numpy as np
 import math
 import random
 from datetime import datetime
 import os
 import re
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from tabulate import tabulate  # For formatted table output
 import pandas as pd  # For reading CSV files and exporting results
 import csv  # For writing CSV files
@@ -26,18 +31,360 @@ import csv  # For writing CSV files
 # LangGraph and LangChain related
 from langgraph.graph import StateGraph, END
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatResult
 from langchain_core.tools import BaseTool, tool
 from langchain_openai import ChatOpenAI
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
+
+# ====================== LLM Backend ======================
+
+# Default LLM settings, overridden by a JSON file named in WA_LLM_CONFIG and then by the
+# individual environment variables, e.g. WA_LLM_BACKEND=fake WA_FAKE_LLM_LATENCY=0.5
+DEFAULT_LLM_CONFIG = {
+    "backend": "openai",  # "openai" (any OpenAI-compatible endpoint) or "fake" (offline, rule-based)
+    "model": "deepseek-chat",
+    "base_url": "https://api.deepseek.com",
+    "api_key": None,  # Set WA_LLM_API_KEY or "api_key" in the JSON config for the "openai" backend
+    "temperature": 0,
+    "fake_latency": 0.0,  # Seconds the fake backend waits per call, to mimic a network round trip
+    "cache_path": None,  # SQLite file for the response cache; None disables caching
+    "cache_max_entries": 10000
+}
 
-# Set up LLM
-llm = ChatOpenAI(
-    api_key="sk-9f0aad159bf54827a991caf602cb084d",
-    base_url="https://api.deepseek.com",
-    model="deepseek-chat",
-    temperature=0
+LLM_CONFIG_ENV = {
+    "backend": "WA_LLM_BACKEND",
+    "model": "WA_LLM_MODEL",
+    "base_url": "WA_LLM_BASE_URL",
+    "api_key": "WA_LLM_API_KEY",
+    "temperature": "WA_LLM_TEMPERATURE",
+    "fake_latency": "WA_FAKE_LLM_LATENCY",
+    "cache_path": "WA_LLM_CACHE",
+    "cache_max_entries": "WA_LLM_CACHE_MAX_ENTRIES"
+}
+
+def load_llm_config(config_path=None):
+    """Build the LLM configuration from the defaults, an optional JSON file and environment variables"""
+    config = dict(DEFAULT_LLM_CONFIG)
+    
+    config_path = config_path or os.environ.get("WA_LLM_CONFIG")
+    if config_path:
+        with open(config_path, 'r', encoding='utf-8') as file:
+            config.update(json.load(file))
+    
+    for key, env_name in LLM_CONFIG_ENV.items():
+        if os.environ.get(env_name):
+            config[key] = os.environ[env_name]
+    
+    # Environment values are strings
+    config["temperature"] = float(config["temperature"])
+    config["fake_latency"] = float(config["fake_latency"])
+    config["cache_max_entries"] = int(config["cache_max_entries"])
+    return config
+
+def classify_request_keywords(request):
+    """Keyword vote between eMBB and URLLC, using the indicator words of the intent prompt"""
+    request_lower = request.lower()
+    embb_words = ["stream", "download", "upload", "video", "hd", "4k", "8k", "movie", "watch", "gaming",
+                  "game", "browse", "surf"]
+    urllc_words = ["control", "real-time", "monitor", "automation", "sensor", "immediate", "mission-critical",
+                   "safety", "emergency", "surgery", "robot"]
+    embb_score = sum(word in request_lower for word in embb_words)
+    urllc_score = sum(word in request_lower for word in urllc_words)
+    return "URLLC" if urllc_score > embb_score else "eMBB"
+
+def fake_llm_reply(messages):
+    """Rule-derived reply to the workflow's prompts, shaped the way the nodes parse real replies"""
+    prompt = messages[-1].content
+    
+    # Bandwidth recommendation from beamforming_tool: a single integer in the allowed range
+    if "recommend an appropriate bandwidth allocation" in prompt:
+        request = re.search(r'User Request: "(.*)"', prompt).group(1)
+        slice_type = re.search(r'Slice Type: (eMBB|URLLC)', prompt).group(1)
+        min_bandwidth, max_bandwidth = map(int, re.search(r'between (\d+)-(\d+) MHz', prompt).groups())
+        return str(apply_heuristic_bandwidth(slice_type, request, min_bandwidth, max_bandwidth))
+    
+    # Fast-path decision: one JSON object following FastPathDecision
+    if "Respond with a single JSON object" in prompt:
+        request = re.search(r'User request: "(.*)"', prompt).group(1)
+        slice_type = classify_request_keywords(request)
+        min_bandwidth, max_bandwidth = (6, 20) if slice_type == "eMBB" else (1, 5)
+        return json.dumps({
+            "application_type": request,
+            "slice_type": slice_type,
+            "bandwidth_mhz": apply_heuristic_bandwidth(slice_type, request, min_bandwidth, max_bandwidth),
+            "rationale": f"This application primarily needs {'high bandwidth' if slice_type == 'eMBB' else 'low latency and high reliability'}."
+        })
+    
+    # The user's request text appears in the initial message of every conversation
+    request = ""
+    for message in messages:
+        request_match = re.search(r'Request: "(.*)"', message.content)
+        if request_match:
+            request = request_match.group(1)
+            break
+    slice_type = classify_request_keywords(request)
+    need = "high bandwidth" if slice_type == "eMBB" else "low latency and high reliability"
+    
+    if "EXPLICIT recommendation" in prompt:
+        return f"I recommend using {slice_type} slice, because this application primarily needs {need}."
+    if "Based on the user request:" in prompt:
+        return (f"Analysis:\n1. Application type: {request}\n"
+                f"2. Network requirements: {need}\n"
+                f"3. Slice recommendation: {slice_type} is most appropriate for this request")
+    return "Acknowledged. The allocation is consistent with the user's requirements."
+
+class RuleBasedChatModel(BaseChatModel):
+    """In-process stand-in for the remote LLM: no network, deterministic replies, configurable latency"""
+    model_name: str = "rule-based"
+    temperature: float = 0
+    latency: float = 0.0
+    calls: int = 0
+    _calls_lock: Any = PrivateAttr(default_factory=threading.Lock)
+    
+    @property
+    def _llm_type(self) -> str:
+        return "rule-based"
+    
+    def _count_call(self):
+        # Narration threads and the main flow call the model concurrently
+        with self._calls_lock:
+            self.calls += 1
+    
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self._count_call()
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=fake_llm_reply(messages)))])
+    
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self._count_call()
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        # Build the reply off the event loop, like a real client waiting on the network
+        content = await asyncio.to_thread(fake_llm_reply, messages)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+# First user message of every conversation (see initialize)
+USER_HEADER_TEMPLATE = """
+New User ID: {user_id}
+Location: {location}
+Request: "{request}"
+Channel Quality Indicator (CQI): {cqi}
+
+Please analyze this request to understand the user's intent and network requirements.
+"""
+
+# The same header as a pattern, to recognize it when building cache keys
+USER_HEADER_PATTERN = re.compile(
+    re.escape(USER_HEADER_TEMPLATE)
+    .replace(re.escape("{user_id}"), "(?P<user_id>.*)")
+    .replace(re.escape("{location}"), "(?P<location>.*)")
+    .replace(re.escape("{request}"), "(?P<request>.*)")
+    .replace(re.escape("{cqi}"), "(?P<cqi>.*)")
 )
 
+def cache_key_content(content):
+    """Message content as it enters a cache key
+    
+    Only the conversation header is rewritten: its user ID and location identify who asks,
+    not what is asked, so they are blanked and a repeated request from another user with the
+    same CQI hits. Every other prompt, including CQI wherever it appears, is kept as is.
+    """
+    content = str(content)
+    header = USER_HEADER_PATTERN.fullmatch(content)
+    if header is not None:
+        content = USER_HEADER_TEMPLATE.format(user_id="", location="", request=header["request"], cqi=header["cqi"])
+    return " ".join(content.split())
+
+class LLMResponseCache:
+    """Persistent SQLite cache of LLM replies with least-recently-used eviction
+    
+    Keys are a SHA-256 of the model, the temperature, the call options and the request-level
+    message content, so the same request sent to the same model is answered from disk across
+    runs. Recency updates from hits are batched and written with the next put, flush or stats.
+    """
+    
+    def __init__(self, path, max_entries=10000, touch_batch=256):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_batch = touch_batch
+        self.hits = 0
+        self.misses = 0
+        self.touched = {}
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, model TEXT, content TEXT, created REAL, last_used REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.conn.commit()
+    
+    @staticmethod
+    def make_key(model, temperature, messages, options=None):
+        """Hash of model, temperature, call options (stop, response_format, ...) and messages
+        
+        Content goes through cache_key_content, so the header's user ID and location and any
+        whitespace differences do not change the key.
+        """
+        normalized = [[message.type, cache_key_content(message.content)] for message in messages]
+        payload = json.dumps({
+            "model": model,
+            "temperature": float(temperature),
+            "options": options or {},
+            "messages": normalized
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def get(self, key):
+        """Return the cached reply for key (marking it as recently used), or None"""
+        with self.lock:
+            row = self.conn.execute("SELECT content FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.touched[key] = time.time()
+            if len(self.touched) >= self.touch_batch:
+                self._flush_touched()
+                self.conn.commit()
+            return row[0]
+    
+    def _flush_touched(self):
+        """Write pending last_used updates (caller holds the lock and commits)"""
+        if self.touched:
+            self.conn.executemany(
+                "UPDATE responses SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self.touched.items()]
+            )
+            self.touched.clear()
+    
+    def flush(self):
+        """Write pending last_used updates from cache hits"""
+        with self.lock:
+            self._flush_touched()
+            self.conn.commit()
+    
+    def put(self, key, model, content):
+        """Store a reply and evict the least recently used entries beyond max_entries"""
+        with self.lock:
+            # Recency from earlier hits must be on disk before choosing what to evict
+            self._flush_touched()
+            now = time.time()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, content, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, model, content, now, now)
+            )
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.conn.commit()
+    
+    def clear(self):
+        """Remove all entries and reset the counters"""
+        with self.lock:
+            self.touched.clear()
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+            self.hits = 0
+            self.misses = 0
+    
+    def stats(self):
+        """Hit/miss counters for this process and the number of stored entries"""
+        with self.lock:
+            self._flush_touched()
+            self.conn.commit()
+            entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "max_entries": self.max_entries
+        }
+
+class CachedChatModel(BaseChatModel):
+    """Wraps a chat model so that repeated prompts are answered from an LLMResponseCache"""
+    chat_model: BaseChatModel
+    response_cache: Any
+    model_key: str
+    temperature: float = 0
+    
+    @property
+    def _llm_type(self) -> str:
+        return f"cached-{self.chat_model._llm_type}"
+    
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        key = self.response_cache.make_key(self.model_key, self.temperature, messages, dict(kwargs, stop=stop))
+        content = self.response_cache.get(key)
+        if content is None:
+            content = self.chat_model.invoke(messages, stop=stop, **kwargs).content
+            self.response_cache.put(key, self.model_key, content)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+    
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        key = self.response_cache.make_key(self.model_key, self.temperature, messages, dict(kwargs, stop=stop))
+        # SQLite I/O (and the cache lock) stay off the event loop so concurrent users don't serialize
+        content = await asyncio.to_thread(self.response_cache.get, key)
+        if content is None:
+            content = (await self.chat_model.ainvoke(messages, stop=stop, **kwargs)).content
+            await asyncio.to_thread(self.response_cache.put, key, self.model_key, content)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+def create_openai_llm(config):
+    """Chat model on an OpenAI-compatible endpoint (DeepSeek by default)"""
+    if not config["api_key"]:
+        raise ValueError("The openai LLM backend needs an API key: set WA_LLM_API_KEY or \"api_key\" in the "
+                         "WA_LLM_CONFIG file, or use WA_LLM_BACKEND=fake for the offline model")
+    return ChatOpenAI(
+        api_key=config["api_key"],
+        base_url=config["base_url"],
+        model=config["model"],
+        temperature=config["temperature"]
+    )
+
+def create_fake_llm(config):
+    """Offline rule-based chat model"""
+    return RuleBasedChatModel(temperature=config["temperature"], latency=config["fake_latency"])
+
+# Available backends; add an entry here to plug in another chat model
+LLM_BACKENDS = {
+    "openai": create_openai_llm,
+    "fake": create_fake_llm
+}
+
+def create_llm(config):
+    """Create the chat model for config["backend"], behind the response cache if config["cache_path"] is set"""
+    if config["backend"] not in LLM_BACKENDS:
+        raise ValueError(f"Unknown LLM backend: {config['backend']} (available: {', '.join(LLM_BACKENDS)})")
+    chat_model = LLM_BACKENDS[config["backend"]](config)
+    
+    if not config["cache_path"]:
+        return chat_model
+    return CachedChatModel(
+        chat_model=chat_model,
+        response_cache=LLMResponseCache(config["cache_path"], config["cache_max_entries"]),
+        model_key=f"{config['backend']}:{config['model']}",
+        temperature=config["temperature"]
+    )
+
+def configure_llm(config=None, **overrides):
+    """Replace the module-level LLM used by all workflow nodes, e.g. configure_llm(backend="fake")"""
+    global llm, LLM_CONFIG
+    LLM_CONFIG = dict(config or load_llm_config())
+    LLM_CONFIG.update(overrides)
+    llm = create_llm(LLM_CONFIG)
+    return llm
+
+# Set up LLM
+LLM_CONFIG = load_llm_config()
+llm = create_llm(LLM_CONFIG)
+
 # ====================== Knowledge Base Access Functions ======================
 
 def load_knowledge_base(file_path):
@@ -48,11 +395,14 @@ def load_knowledge_base(file_path):
         return content
     except Exception as e:
         print(f"Failed to read knowledge base file: {e}")
-        # Provide a simple backup knowledge base content in case the file doesn't exist
-        return content
+        # Fall back to an empty knowledge base; the keyword rules still apply
+        return ""
 
-# Knowledge base file path
-KNOWLEDGE_BASE_PATH = r"C:\Users\Jingwen TONG\Desktop\我的文档\02_项目_202301\16-WirelessAgent-ChinaCom\Simulations\WirelessAgent_LangGraph\Knowledge_Base\Intent_Understand.txt"
+# Knowledge base file path (next to this script unless WA_KNOWLEDGE_BASE is set)
+KNOWLEDGE_BASE_PATH = os.environ.get(
+    "WA_KNOWLEDGE_BASE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "Knowledge_Base", "Intent_Understand.txt")
+)
 
 # Preload knowledge base
 KNOWLEDGE_BASE_CONTENT = load_knowledge_base(KNOWLEDGE_BASE_PATH)
@@ -144,7 +494,13 @@ def load_user_data_from_csv(file_path, num_users=None):
     List of user dictionaries with keys: user_id, location, request, cqi, ground_truth
     """
     try:
-        df = pd.read_csv(file_path)
+        # Typed columnar output from the ray tracer is read as-is; anything else is CSV
+        if file_path.endswith('.parquet'):
+            df = pd.read_parquet(file_path)
+        elif file_path.endswith('.feather'):
+            df = pd.read_feather(file_path)
+        else:
+            df = pd.read_csv(file_path)
         users = []
         
         # Limit to specified number of users if needed
@@ -155,8 +511,10 @@ def load_user_data_from_csv(file_path, num_users=None):
             # Get user ID (RX_ID)
             user_id = str(row['RX_ID'])
             
-            # Create location string from X, Y, Z coordinates
-            location = f"({row['X']}, {row['Y']}, {row['Z']})"
+            # Create location string from X, Y, Z coordinates, rounded to the 2 decimals the CSV
+            # stores so Parquet/Feather rows (full precision) give the same prompt text as the CSV
+            x, y, z = (float(f"{row[axis]:.2f}") for axis in ('X', 'Y', 'Z'))
+            location = f"({x}, {y}, {z})"
             
             # Get request, CQI, and ground truth label
             request = row['User_Request']
@@ -300,6 +658,8 @@ class NetworkState(TypedDict):
     step_count: int
     current_step: str
     final_result: Optional[str]
+    narrate: str
+    narrations: Dict[str, Any]
 
 # ====================== CQI-Related Functions ======================
 
@@ -967,18 +1327,10 @@ def workload_balance_tool(target_slice_type: str, cqi: int, required_bandwidth:
         }
     }
 
-@tool
-def beamforming_tool(user_id: str, slice_type: str, cqi: int, request: str) -> Dict[str, Any]:
-    """Execute beamforming algorithm using CQI and request analysis
+def compute_beamforming(user_id, slice_type, cqi, request, recommended_bandwidth=None):
+    """Allocate bandwidth, rate and latency for a user (see beamforming_tool)
     
-    Parameters:
-    - user_id: User identifier
-    - slice_type: Either "eMBB" or "URLLC"
-    - cqi: Channel Quality Indicator (1-15)
-    - request: User's request text
-    
-    Returns:
-    - Dictionary containing allocated resources
+    If recommended_bandwidth is given it is used instead of asking the LLM.
     """
     # Get current network state to check available resources
     current_state = get_current_network_state()
@@ -1001,8 +1353,12 @@ def beamforming_tool(user_id: str, slice_type: str, cqi: int, request: str) -> D
     # This will get corrected during capacity check later
     max_bandwidth = max(max_bandwidth, min_bandwidth)
     
-    # Create a prompt for the LLM to analyze the request and recommend a bandwidth
-    bandwidth_prompt = f"""
+    if recommended_bandwidth is not None:
+        # Bandwidth already recommended (fast path), only cap it to the allowed range
+        allocated_bandwidth = max(min_bandwidth, min(int(recommended_bandwidth), max_bandwidth))
+    else:
+        # Create a prompt for the LLM to analyze the request and recommend a bandwidth
+        bandwidth_prompt = f"""
 Based on the following user request and network conditions, recommend an appropriate bandwidth allocation:
 
 User Request: "{request}"
@@ -1022,32 +1378,32 @@ Consider:
 
 Please respond with a single integer number representing your recommended bandwidth in MHz.
 """
-    
-    try:
-        # Call LLM to analyze and recommend bandwidth
-        messages = [SystemMessage(content="You are a network resource allocation expert."), 
-                   HumanMessage(content=bandwidth_prompt)]
-        response = llm.invoke(messages)
         
-        # Extract the bandwidth recommendation from the response
-        # Look for an integer in the response
-        bandwidth_match = re.search(r'\b(\d+)\b', response.content)
-        if bandwidth_match:
-            recommended_bandwidth = int(bandwidth_match.group(1))
+        try:
+            # Call LLM to analyze and recommend bandwidth
+            messages = [SystemMessage(content="You are a network resource allocation expert."), 
+                       HumanMessage(content=bandwidth_prompt)]
+            response = llm.invoke(messages)
+        
+            # Extract the bandwidth recommendation from the response
+            # Look for an integer in the response
+            bandwidth_match = re.search(r'\b(\d+)\b', response.content)
+            if bandwidth_match:
+                recommended_bandwidth = int(bandwidth_match.group(1))
             
-            # Validate the recommendation is within allowed range
-            if min_bandwidth <= recommended_bandwidth <= max_bandwidth:
-                allocated_bandwidth = recommended_bandwidth
+                # Validate the recommendation is within allowed range
+                if min_bandwidth <= recommended_bandwidth <= max_bandwidth:
+                    allocated_bandwidth = recommended_bandwidth
+                else:
+                    # If outside range, cap it
+                    allocated_bandwidth = max(min_bandwidth, min(recommended_bandwidth, max_bandwidth))
             else:
-                # If outside range, cap it
-                allocated_bandwidth = max(min_bandwidth, min(recommended_bandwidth, max_bandwidth))
-        else:
-            # Fallback if no number found
+                # Fallback if no number found
+                allocated_bandwidth = apply_heuristic_bandwidth(slice_type, request, min_bandwidth, max_bandwidth)
+        except Exception as e:
+            print(f"LLM bandwidth recommendation failed: {e}")
+            # Fallback to heuristic
             allocated_bandwidth = apply_heuristic_bandwidth(slice_type, request, min_bandwidth, max_bandwidth)
-    except Exception as e:
-        print(f"LLM bandwidth recommendation failed: {e}")
-        # Fallback to heuristic
-        allocated_bandwidth = apply_heuristic_bandwidth(slice_type, request, min_bandwidth, max_bandwidth)
     
     # Determine latency based on application type
     allocated_latency = apply_heuristic_latency(slice_type, request, min_latency, max_latency)
@@ -1114,6 +1470,21 @@ Please respond with a single integer number representing your recommended bandwi
         "adjustment_needed": 0 if has_capacity else adjustment_needed
     }
 
+@tool
+def beamforming_tool(user_id: str, slice_type: str, cqi: int, request: str) -> Dict[str, Any]:
+    """Execute beamforming algorithm using CQI and request analysis
+    
+    Parameters:
+    - user_id: User identifier
+    - slice_type: Either "eMBB" or "URLLC"
+    - cqi: Channel Quality Indicator (1-15)
+    - request: User's request text
+    
+    Returns:
+    - Dictionary containing allocated resources
+    """
+    return compute_beamforming(user_id, slice_type, cqi, request)
+
 @tool
 def slice_allocation(user_id: str, slice_type: str, rate: float, latency: float, cqi: int, bandwidth: int) -> Dict[str, Any]:
     """Allocate user to slice and update network state
@@ -1217,10 +1588,74 @@ When deciding on the slice type, also consider network load balancing - if one s
 
 Please clearly state in your answer: "I recommend using [eMBB/URLLC] slice, because...", and provide detailed reasons."""
 
+# ====================== Narration Policy ======================
+
+# How narrative-only LLM calls (resource review, final evaluation) are made:
+# - "inline": in the workflow, before the node returns (original behaviour)
+# - "async": submitted to a background thread after the allocation is decided; see collect_narrations
+# - "off": not made at all; final_result is a plain allocation summary
+NARRATE_MODES = ("off", "async", "inline")
+
+# Started on the first async narration and shut down by collect_narrations
+NARRATION_EXECUTOR = None
+
+def narrate(state, messages, kind):
+    """Make a narrative-only LLM call according to state["narrate"]; returns the text in inline mode, else None
+    
+    In async mode the pending call is stored in state["narrations"][kind], so it travels with
+    this request's result (see build_detailed_result and collect_narrations).
+    """
+    global NARRATION_EXECUTOR
+    mode = state.get("narrate", "inline")
+    if mode == "inline":
+        return llm.invoke(messages).content
+    if mode == "async":
+        if NARRATION_EXECUTOR is None:
+            NARRATION_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="narrate")
+        state.setdefault("narrations", {})[kind] = NARRATION_EXECUTOR.submit(llm.invoke, messages)
+    return None
+
+def collect_narrations(results):
+    """Wait for the async narratives of the given detailed results
+    
+    The pending calls of each result ("narrations") are replaced by their texts in
+    result["narrative"] ({kind: text}). The narration thread pool is shut down afterwards;
+    the next async narration starts a new one. Returns the number of results collected.
+    """
+    global NARRATION_EXECUTOR
+    collected = 0
+    for result in results:
+        if "narrations" not in result:
+            continue
+        narrative = {}
+        for kind, future in result.pop("narrations").items():
+            try:
+                narrative[kind] = future.result().content
+            except Exception as e:
+                narrative[kind] = f"Narration failed: {e}"
+        result["narrative"] = narrative
+        collected += 1
+    
+    if NARRATION_EXECUTOR is not None:
+        NARRATION_EXECUTOR.shutdown(wait=True)
+        NARRATION_EXECUTOR = None
+    return collected
+
+def describe_allocation(user_id, slice_type, beamforming_result):
+    """One-line allocation summary used when no LLM narrative is available"""
+    return (f"User {user_id} allocated to {slice_type} slice: "
+            f"{beamforming_result['allocated_bandwidth']} MHz, "
+            f"{beamforming_result['allocated_rate']:.2f} Mbps, "
+            f"{beamforming_result['allocated_latency']} ms.")
+
 # ====================== Workflow Nodes ======================
 
 def initialize(state: NetworkState) -> NetworkState:
     """Initialize state - Step 1: Receive user request and CQI"""
+    return snapshot_network_state(initialize_request(state))
+
+def initialize_request(state: NetworkState) -> NetworkState:
+    """Request part of initialize: conversation header from the user's own fields, no network state"""
     state["history"] = []
     state["memory"] = {}
     state["step_count"] = 0
@@ -1230,16 +1665,14 @@ def initialize(state: NetworkState) -> NetworkState:
     state["history"].append({"role": "system", "content": SYSTEM_PROMPT})
     
     # Add user request
-    user_request = f"""
-New User ID: {state["user_id"]}
-Location: {state["location"]}
-Request: "{state["request"]}"
-Channel Quality Indicator (CQI): {state["cqi"]}
-
-Please analyze this request to understand the user's intent and network requirements.
-"""
+    user_request = USER_HEADER_TEMPLATE.format(
+        user_id=state["user_id"], location=state["location"], request=state["request"], cqi=state["cqi"]
+    )
     state["history"].append({"role": "user", "content": user_request})
-    
+    return state
+
+def snapshot_network_state(state: NetworkState) -> NetworkState:
+    """Network part of initialize: record the network state the allocation starts from"""
     # Get current network state
     network_state = network_monitor.invoke({})
     state["memory"]["network_state"] = network_state
@@ -1255,8 +1688,8 @@ Please analyze this request to understand the user's intent and network requirem
     """
     return state
 
-def understand_intent(state: NetworkState) -> NetworkState:
-    """Step 1: Understand user intent by analyzing request"""
+def prepare_intent_analysis(state):
+    """Step 1 before the LLM call: knowledge base lookup and intent prompt; returns the messages to send"""
     state["step_count"] += 1
     
     # Get the request for analysis
@@ -1353,10 +1786,10 @@ Please provide a similarly detailed analysis with a clear slice recommendation f
         elif msg["role"] == "assistant":
             messages.append(AIMessage(content=msg["content"]))
     
-    # Call LLM to analyze intent
-    response = llm.invoke(messages)
-    analysis = response.content
-    
+    return messages
+
+def record_intent_analysis(state, analysis):
+    """Step 1 after the LLM call: record the analysis"""
     # Record response
     state["history"].append({"role": "assistant", "content": analysis})
     
@@ -1365,6 +1798,20 @@ Please provide a similarly detailed analysis with a clear slice recommendation f
     
     return state
 
+def understand_intent(state: NetworkState) -> NetworkState:
+    """Step 1: Understand user intent by analyzing request"""
+    messages = prepare_intent_analysis(state)
+    
+    # Call LLM to analyze intent
+    response = llm.invoke(messages)
+    return record_intent_analysis(state, response.content)
+
+async def aunderstand_intent(state: NetworkState) -> NetworkState:
+    """Async version of understand_intent"""
+    messages = prepare_intent_analysis(state)
+    response = await llm.ainvoke(messages)
+    return record_intent_analysis(state, response.content)
+
 def allocate_slice_type(state: NetworkState) -> NetworkState:
     """Step 2: Allocate appropriate slice type based on intent"""
     state["step_count"] += 1
@@ -1699,12 +2146,12 @@ Please review these resource allocations and confirm if they are appropriate for
         elif msg["role"] == "assistant":
             messages.append(AIMessage(content=msg["content"]))
     
-    # Call LLM to review resource allocation
-    response = llm.invoke(messages)
-    review = response.content
+    # Call LLM to review resource allocation (narrative only, no decision depends on it)
+    review = narrate(state, messages, "review")
     
     # Record response
-    state["history"].append({"role": "assistant", "content": review})
+    if review is not None:
+        state["history"].append({"role": "assistant", "content": review})
     
     # Check if we can proceed with allocation
     can_allocate = state["memory"]["adjustment_result"]["has_capacity"]
@@ -1751,10 +2198,11 @@ Please provide a final summary explaining why this user couldn't be accommodated
                 messages.append(AIMessage(content=msg["content"]))
         
         # Call LLM to generate failure evaluation
-        response = llm.invoke(messages)
-        evaluation = response.content
+        evaluation = narrate(state, messages, "evaluation")
         
         # Record final result
+        if evaluation is None:
+            evaluation = f"Allocation failed: insufficient capacity in {state['memory']['final_slice']} slice even after dynamic adjustment attempts."
         state["final_result"] = evaluation
         
         # Print concise failure report
@@ -1890,10 +2338,11 @@ Include details about any dynamic adjustments or workload balancing made to acco
             messages.append(AIMessage(content=msg["content"]))
     
     # Call LLM to generate network evaluation
-    response = llm.invoke(messages)
-    evaluation = response.content
+    evaluation = narrate(state, messages, "evaluation")
     
     # Record final result
+    if evaluation is None:
+        evaluation = describe_allocation(state["user_id"], final_slice, beamforming_result)
     state["final_result"] = evaluation
     
     return state
@@ -1974,9 +2423,342 @@ def create_network_graph():
     # Compile graph
     return graph.compile()
 
+# ====================== Fast-Path Workflow ======================
+
+class FastPathDecision(BaseModel):
+    """Structured reply of the single fast-path LLM call"""
+    application_type: str = Field(description="Application implied by the request")
+    slice_type: Literal["eMBB", "URLLC"] = Field(description="Recommended network slice")
+    bandwidth_mhz: int = Field(description="Recommended bandwidth in MHz within the slice's range")
+    rationale: str = Field(description="One or two sentences explaining the recommendation")
+
+FAST_PATH_SYSTEM_PROMPT = """You are a 5G network slicing management expert. Classify each user request as eMBB or URLLC and recommend a bandwidth.
+
+- eMBB (Enhanced Mobile Broadband): high bandwidth applications such as video streaming, downloads, AR/VR, video calls; bandwidth 6-20 MHz (integer), latency 10-100ms
+- URLLC (Ultra-Reliable Low Latency): low latency applications such as remote control, automation, real-time monitoring, IoT sensors; bandwidth 1-5 MHz (integer), latency 1-10ms
+
+Words indicating eMBB: stream, download, upload, video, HD, 4K, 8K, movie, watch, gaming, browse, surfing
+Words indicating URLLC: control, real-time, monitor, automation, sensors, immediate, mission-critical, safety, emergency"""
+
+def create_fast_path_prompt(request, cqi):
+    """Prompt of the fast-path call; it only depends on the request and CQI so replies are cacheable"""
+    return f"""
+User request: "{request}"
+Channel Quality Indicator (CQI): {cqi} (1-15, higher means better signal quality)
+
+Respond with a single JSON object that follows this JSON schema, and nothing else:
+{json.dumps(FastPathDecision.model_json_schema())}
+"""
+
+def parse_fast_path_decision(content):
+    """Validate the fast-path reply against FastPathDecision; returns a dict or None"""
+    json_match = re.search(r'\{.*\}', content, re.DOTALL)
+    if not json_match:
+        return None
+    try:
+        return FastPathDecision.model_validate_json(json_match.group(0)).model_dump()
+    except ValueError:
+        return None
+
+def prepare_fast_decision(state):
+    """Fast path step 1 before the LLM call: knowledge base lookup and structured prompt; returns the messages"""
+    state["step_count"] += 1
+    
+    # Knowledge base recommendation, as in understand_intent
+    kb_recommended_slice, kb_reasons = get_application_slice_type(state["request"])
+    state["memory"]["kb_recommended_slice"] = kb_recommended_slice
+    state["memory"]["kb_slice_reasons"] = kb_reasons
+    
+    print(f"Knowledge Base recommended slice: {kb_recommended_slice} ({kb_reasons[0]})")
+    
+    fast_prompt = create_fast_path_prompt(state["request"], state["cqi"])
+    state["history"].append({"role": "user", "content": fast_prompt})
+    return [SystemMessage(content=FAST_PATH_SYSTEM_PROMPT), HumanMessage(content=fast_prompt)]
+
+def apply_fast_decision(state, content):
+    """Fast path step 1 after the LLM call: validate the reply (None if the call failed) and apply the override"""
+    kb_recommended_slice = state["memory"]["kb_recommended_slice"]
+    decision = None
+    if content is not None:
+        state["history"].append({"role": "assistant", "content": content})
+        decision = parse_fast_path_decision(content)
+    
+    state["memory"]["fast_decision"] = decision
+    
+    # Knowledge base override, applied without asking the LLM to acknowledge it
+    if decision is None:
+        state["memory"]["final_slice"] = kb_recommended_slice
+        state["memory"]["intent_override_applied"] = True
+        print("WARNING: LLM didn't provide a valid structured decision. Using knowledge base recommendation.")
+    else:
+        state["memory"]["llm_recommended_slice"] = decision["slice_type"]
+        if decision["slice_type"] != kb_recommended_slice:
+            print(f"LLM recommended {decision['slice_type']} but knowledge base recommended {kb_recommended_slice}, using knowledge base recommendation")
+            state["memory"]["final_slice"] = kb_recommended_slice
+            state["memory"]["intent_override_applied"] = True
+        else:
+            state["memory"]["final_slice"] = decision["slice_type"]
+            state["memory"]["intent_override_applied"] = False
+    
+    state["current_step"] = "fast_commit"
+    return state
+
+def fast_decide(state: NetworkState) -> NetworkState:
+    """Fast path step 1: intent, slice and bandwidth from a single structured LLM call"""
+    messages = prepare_fast_decision(state)
+    
+    # JSON mode keeps OpenAI-compatible endpoints from answering in prose; the schema is in the prompt
+    try:
+        content = llm.invoke(messages, response_format={"type": "json_object"}).content
+    except Exception as e:
+        print(f"Fast-path LLM call failed: {e}")
+        content = None
+    return apply_fast_decision(state, content)
+
+async def afast_decide(state: NetworkState) -> NetworkState:
+    """Async version of fast_decide"""
+    messages = prepare_fast_decision(state)
+    try:
+        content = (await llm.ainvoke(messages, response_format={"type": "json_object"})).content
+    except Exception as e:
+        print(f"Fast-path LLM call failed: {e}")
+        content = None
+    return apply_fast_decision(state, content)
+
+def fast_recommended_bandwidth(state, slice_type):
+    """Bandwidth from the fast-path decision if it was made for slice_type, otherwise the heuristic"""
+    decision = state["memory"].get("fast_decision")
+    if decision is not None and decision["slice_type"] == slice_type:
+        return decision["bandwidth_mhz"]
+    return apply_heuristic_bandwidth(slice_type, state["request"], 1, 20)
+
+def fast_commit(state: NetworkState) -> NetworkState:
+    """Fast path step 2: deterministic workload balancing, beamforming, capacity adjustment and allocation"""
+    state["step_count"] += 1
+    cqi = state["cqi"]
+    final_slice = state["memory"]["final_slice"]
+    
+    # Workload balancing with the estimated bandwidth, as in allocate_slice_type
+    estimated_bandwidth = 10 if final_slice == "eMBB" else 3
+    balance_result = workload_balance_tool.invoke({
+        "target_slice_type": final_slice,
+        "cqi": cqi,
+        "required_bandwidth": estimated_bandwidth
+    })
+    state["memory"]["balance_result"] = balance_result
+    state["memory"]["balance_applied"] = balance_result["should_rebalance"]
+    if balance_result["should_rebalance"]:
+        final_slice = balance_result["recommended_slice"]
+    
+    beamforming_result = compute_beamforming(
+        state["user_id"], final_slice, cqi, state["request"], fast_recommended_bandwidth(state, final_slice)
+    )
+    
+    # Check balance again with the actual bandwidth, as in allocate_resources
+    if not state["memory"]["balance_applied"]:
+        balance_result = workload_balance_tool.invoke({
+            "target_slice_type": final_slice,
+            "cqi": cqi,
+            "required_bandwidth": beamforming_result["allocated_bandwidth"]
+        })
+        state["memory"]["balance_result"] = balance_result
+        if balance_result["should_rebalance"]:
+            state["memory"]["original_slice"] = final_slice
+            state["memory"]["original_beamforming"] = beamforming_result
+            state["memory"]["balance_applied"] = True
+            final_slice = balance_result["recommended_slice"]
+            beamforming_result = compute_beamforming(
+                state["user_id"], final_slice, cqi, state["request"], fast_recommended_bandwidth(state, final_slice)
+            )
+    
+    state["memory"]["final_slice"] = final_slice
+    state["memory"]["beamforming_result"] = beamforming_result
+    
+    # Dynamic capacity adjustment if the slice is full
+    if beamforming_result["has_capacity"]:
+        adjustment_result = {"has_capacity": True, "adjustments_made": False, "user_adjustments": []}
+    else:
+        adjustment_result = check_and_adjust_capacity.invoke({
+            "slice_type": final_slice,
+            "required_bandwidth": beamforming_result["allocated_bandwidth"]
+        })
+    state["memory"]["adjustment_result"] = adjustment_result
+    
+    decision = state["memory"]["fast_decision"]
+    rationale = decision["rationale"] if decision else state["memory"]["kb_slice_reasons"][0]
+    
+    if not adjustment_result["has_capacity"]:
+        state["memory"]["allocation_failed"] = True
+        state["final_result"] = (f"Allocation failed: insufficient capacity in {final_slice} slice "
+                                 f"even after dynamic adjustment attempts.")
+        
+        print("\n" + "-"*40)
+        print(f"ALLOCATION FAILED FOR USER {state['user_id']}")
+        print("-"*40)
+        print(f"Request: {state['request']}")
+        print(f"Slice type: {final_slice}")
+        print(f"Reason: Insufficient capacity even after attempted adjustments")
+        
+        state["current_step"] = "done"
+        return state
+    
+    allocation_result = slice_allocation.invoke({
+        "user_id": state["user_id"],
+        "slice_type": final_slice,
+        "rate": beamforming_result["allocated_rate"],
+        "latency": beamforming_result["allocated_latency"],
+        "cqi": cqi,
+        "bandwidth": beamforming_result["allocated_bandwidth"]
+    })
+    state["memory"]["allocation_result"] = allocation_result
+    state["memory"]["updated_network_state"] = network_monitor.invoke({})
+    
+    adjusted_user_ids = [adj["user_id"] for adj in adjustment_result["user_adjustments"]]
+    
+    # Print concise report and user allocation table
+    print("\n" + "-"*40)
+    print(f"ALLOCATION RESULT FOR USER {state['user_id']}")
+    print("-"*40)
+    print(generate_concise_report(get_current_network_state(), state["user_id"], adjustment_result))
+    print(generate_user_allocation_table(get_current_network_state(), state["user_id"], adjusted_user_ids))
+    
+    state["final_result"] = f"{describe_allocation(state['user_id'], final_slice, beamforming_result)} {rationale}"
+    
+    state["current_step"] = "done"
+    return state
+
+def create_fast_network_graph():
+    """Create the fast-path workflow graph: one LLM call, then a deterministic commit"""
+    graph = StateGraph(NetworkState)
+    
+    graph.add_node("initialize", initialize)
+    graph.add_node("fast_decide", fast_decide)
+    graph.add_node("fast_commit", fast_commit)
+    
+    graph.set_entry_point("initialize")
+    graph.add_edge("initialize", "fast_decide")
+    graph.add_edge("fast_decide", "fast_commit")
+    graph.add_edge("fast_commit", END)
+    
+    return graph.compile()
+
 # ====================== Main Function ======================
 
-def process_user_request(user_id, location, request, cqi=None, ground_truth=None, override_network_state=None):
+def create_initial_state(user_id, location, request, cqi, narrate="inline"):
+    """Initial workflow state for one user"""
+    return {
+        "user_id": user_id,
+        "location": location,
+        "request": request,
+        "cqi": cqi,
+        "history": [],
+        "memory": {},
+        "step_count": 0,
+        "current_step": "",
+        "final_result": None,
+        "narrate": narrate,
+        "narrations": {}
+    }
+
+def collect_network_stats():
+    """Total rate of each slice and average resource utilization, for before/after comparison"""
+    embb_total_rate, urllc_total_rate = calculate_total_transmission_rates()
+    return embb_total_rate, urllc_total_rate, calculate_average_resource_utilization()
+
+def build_detailed_result(result, user_id, request, cqi, ground_truth, initial_stats):
+    """Per-user result row from a finished workflow state and the network stats before it ran"""
+    initial_embb_total_rate, initial_urllc_total_rate, initial_avg_resource_util = initial_stats
+    
+    # Get final network state for resource utilization comparison
+    final_network_state = get_current_network_state()
+    
+    # Get final total transmission rates
+    final_embb_total_rate, final_urllc_total_rate = calculate_total_transmission_rates()
+    
+    # Get final average resource utilization
+    final_avg_resource_util = calculate_average_resource_utilization()
+    
+    final_embb_util = final_network_state["embb_slice"]["utilization_rate"]
+    final_urllc_util = final_network_state["urllc_slice"]["utilization_rate"]
+    
+    # Get detailed allocation results
+    detailed_result = {
+        "user_id": user_id,
+        "request": request,
+        "cqi": cqi,
+        "ground_truth": ground_truth,
+        "allocation_failed": result["memory"].get("allocation_failed", False)
+    }
+    
+    # Add slice type
+    if "memory" in result and "final_slice" in result["memory"]:
+        detailed_result["slice_type"] = result["memory"]["final_slice"]
+    else:
+        detailed_result["slice_type"] = "Failed"
+    
+    # Check if intent understanding matches ground truth
+    if ground_truth is not None and detailed_result["slice_type"] != "Failed":
+        detailed_result["intent_correct"] = (detailed_result["slice_type"] == ground_truth)
+    else:
+        detailed_result["intent_correct"] = None
+    
+    # Add bandwidth, rate, latency
+    if "memory" in result and "beamforming_result" in result["memory"]:
+        beamforming = result["memory"]["beamforming_result"]
+        detailed_result["bandwidth"] = beamforming["allocated_bandwidth"]
+        detailed_result["rate"] = beamforming["allocated_rate"]
+        detailed_result["latency"] = beamforming["allocated_latency"]
+    
+    # Add adjustments made
+    if "memory" in result and "adjustment_result" in result["memory"]:
+        detailed_result["adjustments_made"] = result["memory"]["adjustment_result"].get("adjustments_made", False)
+    
+    # Add transmission rate statistics
+    detailed_result["embb_total_rate_before"] = initial_embb_total_rate
+    detailed_result["embb_total_rate_after"] = final_embb_total_rate
+    detailed_result["urllc_total_rate_before"] = initial_urllc_total_rate
+    detailed_result["urllc_total_rate_after"] = final_urllc_total_rate
+    
+    # Add average resource utilization
+    detailed_result["avg_resource_util_before"] = initial_avg_resource_util
+    detailed_result["avg_resource_util_after"] = final_avg_resource_util
+
+   # detailed_result["embb_util_before"] = initial_embb_util
+    detailed_result["embb_util_after"] = final_embb_util
+
+    #detailed_result["urllc_util_before"] = initial_urllc_util
+    detailed_result["urllc_util_after"] = final_urllc_util
+    
+    # Pending async narratives of this request, resolved by collect_narrations
+    if result.get("narrations"):
+        detailed_result["narrations"] = result["narrations"]
+    
+    return detailed_result
+
+def build_failed_result(error, user_id, request, cqi, ground_truth, initial_stats):
+    """Per-user result row for a workflow that raised an exception"""
+    initial_embb_total_rate, initial_urllc_total_rate, initial_avg_resource_util = initial_stats
+    print(f"Workflow execution error: {str(error)}")
+    return {
+        "user_id": user_id,
+        "request": request,
+        "cqi": cqi,
+        "ground_truth": ground_truth,
+        "slice_type": "Failed",
+        "allocation_failed": True,
+        "intent_correct": None,
+        "error": str(error),
+        # Include transmission rates even for failures
+        "embb_total_rate_before": initial_embb_total_rate,
+        "embb_total_rate_after": initial_embb_total_rate,
+        "urllc_total_rate_before": initial_urllc_total_rate,
+        "urllc_total_rate_after": initial_urllc_total_rate,
+        "avg_resource_util_before": initial_avg_resource_util,
+        "avg_resource_util_after": initial_avg_resource_util
+    }
+
+def process_user_request(user_id, location, request, cqi=None, ground_truth=None, override_network_state=None,
+                         fast_path=False, narrate="inline"):
     """Main function for processing user requests with resource utilization tracking
     
     Parameters:
@@ -1986,35 +2768,24 @@ def process_user_request(user_id, location, request, cqi=None, ground_truth=None
     - cqi: Channel Quality Indicator (1-15), generated randomly if None
     - ground_truth: Ground truth slice label for evaluating intent understanding
     - override_network_state: Optional state override for testing
+    - fast_path: Use the single-LLM-call workflow (create_fast_network_graph)
+    - narrate: "inline", "async" or "off" for the review/evaluation calls (see NARRATE_MODES)
+    
+    With narrate="async" the result carries the pending narratives under "narrations";
+    pass it to collect_narrations to wait for them.
     """
+    if narrate not in NARRATE_MODES:
+        raise ValueError(f"Unknown narrate mode: {narrate} (available: {', '.join(NARRATE_MODES)})")
+    
     # Generate random CQI if not provided
     if cqi is None:
         cqi = generate_random_cqi()
     
     # Create workflow graph
-    workflow = create_network_graph()
-    
-    # Get initial network state for resource utilization comparison
-    initial_network_state = get_current_network_state()
+    workflow = create_fast_network_graph() if fast_path else create_network_graph()
     
-    # Get initial total transmission rates
-    initial_embb_total_rate, initial_urllc_total_rate = calculate_total_transmission_rates()
-    
-    # Get initial average resource utilization
-    initial_avg_resource_util = calculate_average_resource_utilization()
-    
-    # Initial state
-    initial_state = {
-        "user_id": user_id,
-        "location": location,
-        "request": request,
-        "cqi": cqi,
-        "history": [],
-        "memory": {},
-        "step_count": 0,
-        "current_step": "",
-        "final_result": None
-    }
+    # Get initial total transmission rates and average resource utilization
+    initial_stats = collect_network_stats()
     
     # If override network state is provided
     if override_network_state:
@@ -2023,100 +2794,124 @@ def process_user_request(user_id, location, request, cqi=None, ground_truth=None
     
     # Execute workflow
     try:
-        result = workflow.invoke(initial_state)
-        
-        # Get final network state for resource utilization comparison
-        final_network_state = get_current_network_state()
-        
-        # Get final total transmission rates
-        final_embb_total_rate, final_urllc_total_rate = calculate_total_transmission_rates()
-        
-        # Get final average resource utilization
-        final_avg_resource_util = calculate_average_resource_utilization()
-        
-        final_embb_util = final_network_state["embb_slice"]["utilization_rate"]
-        final_urllc_util = final_network_state["urllc_slice"]["utilization_rate"]
-        
-        # Get detailed allocation results
-        detailed_result = {
-            "user_id": user_id,
-            "request": request,
-            "cqi": cqi,
-            "ground_truth": ground_truth,
-            "allocation_failed": result["memory"].get("allocation_failed", False)
-        }
-        
-        # Add slice type
-        if "memory" in result and "final_slice" in result["memory"]:
-            detailed_result["slice_type"] = result["memory"]["final_slice"]
-        else:
-            detailed_result["slice_type"] = "Failed"
-        
-        # Check if intent understanding matches ground truth
-        if ground_truth is not None and detailed_result["slice_type"] != "Failed":
-            detailed_result["intent_correct"] = (detailed_result["slice_type"] == ground_truth)
-        else:
-            detailed_result["intent_correct"] = None
-        
-        # Add bandwidth, rate, latency
-        if "memory" in result and "beamforming_result" in result["memory"]:
-            beamforming = result["memory"]["beamforming_result"]
-            detailed_result["bandwidth"] = beamforming["allocated_bandwidth"]
-            detailed_result["rate"] = beamforming["allocated_rate"]
-            detailed_result["latency"] = beamforming["allocated_latency"]
-        
-        # Add adjustments made
-        if "memory" in result and "adjustment_result" in result["memory"]:
-            detailed_result["adjustments_made"] = result["memory"]["adjustment_result"].get("adjustments_made", False)
-        
-        # Add transmission rate statistics
-        detailed_result["embb_total_rate_before"] = initial_embb_total_rate
-        detailed_result["embb_total_rate_after"] = final_embb_total_rate
-        detailed_result["urllc_total_rate_before"] = initial_urllc_total_rate
-        detailed_result["urllc_total_rate_after"] = final_urllc_total_rate
-        
-        # Add average resource utilization
-        detailed_result["avg_resource_util_before"] = initial_avg_resource_util
-        detailed_result["avg_resource_util_after"] = final_avg_resource_util
+        result = workflow.invoke(create_initial_state(user_id, location, request, cqi, narrate))
+        return build_detailed_result(result, user_id, request, cqi, ground_truth, initial_stats)
+    except Exception as e:
+        return build_failed_result(e, user_id, request, cqi, ground_truth, initial_stats)
 
-       # detailed_result["embb_util_before"] = initial_embb_util
-        detailed_result["embb_util_after"] = final_embb_util
+# ====================== Async Workflow ======================
 
-        #detailed_result["urllc_util_before"] = initial_urllc_util
-        detailed_result["urllc_util_after"] = final_urllc_util
-        
-        return detailed_result
-    except Exception as e:
-        print(f"Workflow execution error: {str(e)}")
-        return {
-            "user_id": user_id,
-            "request": request,
-            "cqi": cqi,
-            "ground_truth": ground_truth,
-            "slice_type": "Failed",
-            "allocation_failed": True,
-            "intent_correct": None,
-            "error": str(e),
-            # Include transmission rates even for failures
-            "embb_total_rate_before": initial_embb_total_rate,
-            "embb_total_rate_after": initial_embb_total_rate,
-            "urllc_total_rate_before": initial_urllc_total_rate,
-            "urllc_total_rate_after": initial_urllc_total_rate,
-            "avg_resource_util_before": initial_avg_resource_util,
-            "avg_resource_util_after": initial_avg_resource_util
-        }
+def create_intent_graph(fast_path=False):
+    """Intent-analysis stage only; it neither reads nor changes the network state, so users can run it concurrently"""
+    graph = StateGraph(NetworkState)
+    
+    # Only request/CQI-derived inputs here; the network snapshot is taken in the commit graph
+    decide_node = "fast_decide" if fast_path else "understand_intent"
+    graph.add_node("initialize_request", initialize_request)
+    graph.add_node(decide_node, afast_decide if fast_path else aunderstand_intent)
+    
+    graph.set_entry_point("initialize_request")
+    graph.add_edge("initialize_request", decide_node)
+    graph.add_edge(decide_node, END)
+    
+    return graph.compile()
+
+def create_commit_graph(fast_path=False):
+    """Everything after intent analysis; it reads and updates the global network state"""
+    graph = StateGraph(NetworkState)
+    
+    # The network snapshot is taken at commit time, after all earlier users have committed
+    graph.add_node("snapshot_network_state", snapshot_network_state)
+    graph.set_entry_point("snapshot_network_state")
+    if fast_path:
+        graph.add_node("fast_commit", fast_commit)
+        graph.add_edge("snapshot_network_state", "fast_commit")
+        graph.add_edge("fast_commit", END)
+    else:
+        graph.add_node("allocate_slice_type", allocate_slice_type)
+        graph.add_node("allocate_resources", allocate_resources)
+        graph.add_node("evaluate_network", evaluate_network)
+        graph.add_edge("snapshot_network_state", "allocate_slice_type")
+        graph.add_edge("allocate_slice_type", "allocate_resources")
+        graph.add_edge("allocate_resources", "evaluate_network")
+        graph.add_edge("evaluate_network", END)
+    
+    return graph.compile()
 
-def main(num_users=4, export_file="fileName.csv"):
+async def aprocess_users(users, max_concurrency=8, fast_path=False, narrate="inline", reset_between_users=False):
+    """Process users with concurrent intent analysis and a serialized commit step
+    
+    Parameters:
+    - users: User dictionaries as returned by load_user_data_from_csv
+    - max_concurrency: Maximum number of users in the intent-analysis stage at once
+    - fast_path: Use the single-LLM-call workflow
+    - narrate: "inline", "async" or "off" for the review/evaluation calls
+    - reset_between_users: Reset the network state before each commit (as main does)
+    
+    The commit step (slice choice, capacity adjustment, allocation) runs for one user at a
+    time in the order of users, so the network state evolves exactly as in a serial run.
+    Returns the detailed results in the same order.
+    """
+    if narrate not in NARRATE_MODES:
+        raise ValueError(f"Unknown narrate mode: {narrate} (available: {', '.join(NARRATE_MODES)})")
+    
+    intent_graph = create_intent_graph(fast_path)
+    commit_graph = create_commit_graph(fast_path)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    async def analyze(state):
+        async with semaphore:
+            return await intent_graph.ainvoke(state)
+    
+    # Start all intent stages at once; the semaphore bounds how many are in flight
+    states = [create_initial_state(user["user_id"], user["location"], user["request"],
+                                   user["cqi"] if user.get("cqi") is not None else generate_random_cqi(), narrate)
+              for user in users]
+    intent_tasks = [asyncio.create_task(analyze(state)) for state in states]
+    
+    # Commit step: admission order, one user at a time
+    detailed_results = []
+    for i, (user, state, task) in enumerate(zip(users, states, intent_tasks)):
+        print_user_header(user, i, len(users))
+        
+        if reset_between_users:
+            reset_network_state()
+        initial_stats = collect_network_stats()
+        
+        try:
+            result = await commit_graph.ainvoke(await task)
+            detailed_results.append(build_detailed_result(result, user["user_id"], user["request"], state["cqi"],
+                                                          user.get("ground_truth"), initial_stats))
+        except Exception as e:
+            detailed_results.append(build_failed_result(e, user["user_id"], user["request"], state["cqi"],
+                                                        user.get("ground_truth"), initial_stats))
+    
+    return detailed_results
+
+def print_user_header(user, index, total):
+    """Print the banner shown before each user's allocation"""
+    print(f"\n{'-'*140}")
+    print(f"PROCESSING USER {user['user_id']} ({index+1}/{total})")
+    print(f"Request: \"{user['request']}\"")
+    print(f"CQI: {user['cqi']}")
+    if user.get('ground_truth'):
+        print(f"Ground Truth Slice: {user['ground_truth']}")
+    print(f"{'-'*140}")
+
+def main(num_users=4, export_file="fileName.csv", fast_path=False, narrate="inline", concurrency=None):
     """Main program with CSV-based user testing and enhanced analytics
     
     Parameters:
     - num_users: Number of users to test (default: 4)
     - export_file: Path to export results CSV file
+    - fast_path: Use the single-LLM-call workflow for every user
+    - narrate: "inline", "async" or "off" for the narrative-only LLM calls
+    - concurrency: If set, run up to this many intent analyses concurrently (see aprocess_users)
     """
     print("Starting network slice management system with CSV-based user testing...\n")
     
     # Path to ray tracing results CSV
-    ray_tracing_csv = r"C:\Users\Jingwen TONG\Desktop\我的文档\02_项目_202301\16-WirelessAgent-ChinaCom\Simulations\WirelessAgent_LangGraph\Knowledge_Base\ray_tracing_results.csv"
+    ray_tracing_csv = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Knowledge_Base", "ray_tracing_results.csv")
     
     # Load users from CSV (limit to specified number)
     users = load_user_data_from_csv(ray_tracing_csv, num_users)
@@ -2131,30 +2926,39 @@ def main(num_users=4, export_file="fileName.csv"):
     urllc_utils = []
     workload_balanced_count = 0
     
+    # Time the whole batch so backends can be compared (LLM calls are counted by the fake backend)
+    start_time = time.perf_counter()
+    backend_llm = getattr(llm, "chat_model", llm)
+    start_calls = getattr(backend_llm, "calls", None)
+    
     # Process each user
-    for i, user in enumerate(users):
-        print(f"\n{'-'*140}")
-        print(f"PROCESSING USER {user['user_id']} ({i+1}/{len(users)})")
-        print(f"Request: \"{user['request']}\"")
-        print(f"CQI: {user['cqi']}")
-        if user.get('ground_truth'):
-            print(f"Ground Truth Slice: {user['ground_truth']}")
-        print(f"{'-'*140}")
-        
-        # Reset network state for clean testing
-        reset_network_state()
-        
-        # Process the user
-        result = process_user_request(
-            user_id=user['user_id'],
-            location=user['location'],
-            request=user['request'],
-            cqi=user['cqi'],
-            ground_truth=user.get('ground_truth')
+    if concurrency:
+        # Intent analysis runs concurrently; allocations are still committed one user at a time
+        detailed_results = asyncio.run(
+            aprocess_users(users, concurrency, fast_path, narrate, reset_between_users=True)
         )
-        
-        # Store detailed result for CSV export
-        detailed_results.append(result)
+    else:
+        for i, user in enumerate(users):
+            print_user_header(user, i, len(users))
+            
+            # Reset network state for clean testing
+            reset_network_state()
+            
+            # Process the user
+            result = process_user_request(
+                user_id=user['user_id'],
+                location=user['location'],
+                request=user['request'],
+                cqi=user['cqi'],
+                ground_truth=user.get('ground_truth'),
+                fast_path=fast_path,
+                narrate=narrate
+            )
+            
+            # Store detailed result for CSV export
+            detailed_results.append(result)
+    
+    for result in detailed_results:
         # Track workload balancing
         if result.get("workload_balanced", False):
             workload_balanced_count += 1
@@ -2182,6 +2986,14 @@ def main(num_users=4, export_file="fileName.csv"):
                 # Handle cases where util might not be a string or doesn't have % format
                 pass
     
+    elapsed_time = time.perf_counter() - start_time
+    
+    # Async narratives finish off the critical path; wait for them before reporting
+    if narrate == "async":
+        collected = collect_narrations(detailed_results)
+        print(f"\nCollected async narratives for {collected} users "
+              f"({time.perf_counter() - start_time - elapsed_time:.2f} s after the last allocation)")
+    
     # Get final network state
     #final_state = get_current_network_state()
     #final_embb_util_str = final_state["embb_slice"]["utilization_rate"]
@@ -2279,6 +3091,17 @@ def main(num_users=4, export_file="fileName.csv"):
     print("\nResource Utilization:")
     print(f"Average resource utilization: {final_avg_resource_util:.2f}%")
     
+    # Print throughput statistics
+    print(f"\nThroughput ({LLM_CONFIG['backend']} backend):")
+    print(f"Processed {total_count} users in {elapsed_time:.2f} s ({total_count/elapsed_time:.2f} users/s)")
+    if start_calls is not None:
+        llm_calls = backend_llm.calls - start_calls
+        print(f"LLM calls: {llm_calls} ({llm_calls/total_count:.1f} per user)")
+    if isinstance(llm, CachedChatModel):
+        cache_stats = llm.response_cache.stats()
+        print(f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+              f"({cache_stats['hit_rate']*100:.1f}% hit rate), {cache_stats['entries']} entries")
+    
     # Prepare data for CSV export
     slice_stats = {
         "avg_resource_util": f"{final_avg_resource_util:.2f}",
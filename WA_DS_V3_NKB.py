@@ -55,7 +55,13 @@ def load_user_data_from_csv(file_path, num_users=None):
     List of user dictionaries with keys: user_id, location, request, cqi, ground_truth
     """
     try:
-        df = pd.read_csv(file_path)
+        # Typed columnar output from the ray tracer is read as-is; anything else is CSV
+        if file_path.endswith('.parquet'):
+            df = pd.read_parquet(file_path)
+        elif file_path.endswith('.feather'):
+            df = pd.read_feather(file_path)
+        else:
+            df = pd.read_csv(file_path)
         users = []
         
         # Limit to specified number of users if needed
@@ -66,8 +72,10 @@ def load_user_data_from_csv(file_path, num_users=None):
             # Get user ID (RX_ID)
             user_id = str(row['RX_ID'])
             
-            # Create location string from X, Y, Z coordinates
-            location = f"({row['X']}, {row['Y']}, {row['Z']})"
+            # Create location string from X, Y, Z coordinates, rounded to the 2 decimals the CSV
+            # stores so Parquet/Feather rows (full precision) give the same prompt text as the CSV
+            x, y, z = (float(f"{row[axis]:.2f}") for axis in ('X', 'Y', 'Z'))
+            location = f"({x}, {y}, {z})"
             
             # Get request, CQI, and ground truth label
             request = row['User_Request']
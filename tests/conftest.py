@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The modules under test are top-level scripts; the offline backend keeps imports network-free
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("WA_LLM_BACKEND", "fake")
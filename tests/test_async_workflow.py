@@ -0,0 +1,13 @@
+import asyncio
+
+import WA_DS_V3_KB as wa
+
+
+def test_intent_stage_does_not_snapshot_network_state():
+    wa.reset_network_state()
+    state = wa.create_initial_state("3", (1.0, 2.0), "I want to watch 4K video", 9)
+    
+    state = asyncio.run(wa.create_intent_graph(fast_path=True).ainvoke(state))
+    
+    assert "network_state" not in state["memory"]
+    assert state["memory"]["final_slice"] in ("eMBB", "URLLC")
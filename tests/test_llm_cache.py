@@ -0,0 +1,40 @@
+from langchain_core.messages import HumanMessage, SystemMessage
+
+import WA_DS_V3_KB as wa
+
+
+def cached_model(tmp_path):
+    cache = wa.LLMResponseCache(str(tmp_path / "cache.sqlite"))
+    return wa.CachedChatModel(chat_model=wa.RuleBasedChatModel(), response_cache=cache, model_key="fake:test")
+
+
+def header(user_id, location, request, cqi):
+    content = wa.USER_HEADER_TEMPLATE.format(user_id=user_id, location=location, request=request, cqi=cqi)
+    return [SystemMessage(content=wa.SYSTEM_PROMPT), HumanMessage(content=content)]
+
+
+def test_fast_path_key_depends_on_cqi(tmp_path):
+    model = cached_model(tmp_path)
+    for cqi in (3, 12):
+        messages = [SystemMessage(content=wa.FAST_PATH_SYSTEM_PROMPT),
+                    HumanMessage(content=wa.create_fast_path_prompt("I want to stream 4K video", cqi))]
+        model.invoke(messages, response_format={"type": "json_object"})
+    stats = model.response_cache.stats()
+    assert (stats["hits"], stats["misses"]) == (0, 2)
+
+
+def test_header_ignores_user_id_and_location_but_not_cqi(tmp_path):
+    model = cached_model(tmp_path)
+    model.invoke(header(1, (10.0, 20.0), "I want to stream 4K video", 7))
+    model.invoke(header(2, (-5.5, 3.25), "I want to stream 4K video", 7))
+    model.invoke(header(3, (10.0, 20.0), "I want to stream 4K video", 9))
+    stats = model.response_cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+def test_call_options_are_part_of_the_key(tmp_path):
+    model = cached_model(tmp_path)
+    messages = [HumanMessage(content="Based on the user request: \"download a file\"")]
+    model.invoke(messages)
+    model.invoke(messages, response_format={"type": "json_object"})
+    assert model.response_cache.stats()["misses"] == 2
@@ -0,0 +1,21 @@
+from pathlib import Path
+
+import pandas as pd
+
+import RayTracing_cqi as rt
+import WA_DS_V3_KB as wa
+
+
+def test_columnar_users_match_csv_users(tmp_path):
+    frame = pd.read_csv(Path(__file__).parents[1] / "Knowledge_Base" / "ray_tracing_results.csv").head(5)
+    # Full-precision coordinates, as the ray tracer writes them to Parquet/Feather
+    frame[["X", "Y", "Z"]] += 0.001234
+    frame = frame.astype({"LOS": bool})
+    
+    users = {}
+    for name in ("results.csv", "results.parquet", "results.feather"):
+        rt.save_results(frame, str(tmp_path / name))
+        users[name] = wa.load_user_data_from_csv(str(tmp_path / name), 5)
+    
+    assert users["results.parquet"] == users["results.csv"]
+    assert users["results.feather"] == users["results.csv"]
@@ -0,0 +1,13 @@
+import numpy as np
+
+import RayTracing_cqi as rt
+
+
+def test_first_waypoints_differ_from_start_positions():
+    # Without buildings nothing blocks a step, so every user walks towards a first waypoint
+    # that is not its own start point, and all of them move on step 1
+    trace = rt.iter_mobility_trace((0.0, 0.0, 20.0), [], (-100.0, 100.0, -100.0, 100.0), 600, 1, seed=0)
+    start, first = next(trace), next(trace)
+    displacement = np.hypot(*(first['positions'][:, :2] - start['positions'][:, :2]).T)
+    assert first['moved'].all()
+    assert (displacement > 0).all()
@@ -0,0 +1,17 @@
+import pandas as pd
+
+import RayTracing_cqi as rt
+
+
+def test_run_map_writes_serving_cell_and_sinr(tmp_path):
+    config = rt.load_config(overrides={
+        'num_tx': 2, 'num_rx': 20, 'seed': 0, 'render': False,
+        'output_dir': str(tmp_path), 'cache_dir': str(tmp_path / 'cache')
+    })
+    rt.run_map(config['maps'][0], config)
+    
+    frame = pd.read_csv(tmp_path / 'ray_tracing_results.csv')
+    assert {'Serving_Cell', 'SINR_dB'} <= set(frame.columns)
+    assert set(frame['Serving_Cell']) <= {1, 2}
+    # SINR counts the other TX as interference, so it never exceeds SNR
+    assert (frame['SINR_dB'] <= frame['SNR_dB'] + 0.01).all()
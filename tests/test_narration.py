@@ -0,0 +1,14 @@
+import WA_DS_V3_KB as wa
+
+
+def test_async_narratives_stay_with_their_request():
+    wa.reset_network_state()
+    first = wa.process_user_request("7", (1.0, 2.0), "I want to watch 4K video", 9, narrate="async")
+    second = wa.process_user_request("7", (1.0, 2.0), "I need to control a robotic arm in real time", 12,
+                                     narrate="async")
+    
+    assert wa.collect_narrations([first, second]) == 2
+    for result in (first, second):
+        assert "narrations" not in result
+        assert set(result["narrative"]) == {"review", "evaluation"}
+    assert wa.NARRATION_EXECUTOR is None